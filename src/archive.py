@@ -0,0 +1,383 @@
+""" Reader of the NScripter archives: .sar archives, and .nsa archives whose
+files can be compressed with SPB (bitmaps), LZSS or bzip2 (NBZ).
+
+Archives are memory-mapped and indexed by normalized file name, so files
+are read without unpacking the whole archive, and only the files a script
+references are extracted, in a pool of processes.
+"""
+import bz2, collections, mmap, multiprocessing, os, struct
+
+from assets import normalize
+from bake import split_image
+from lexer import type_code
+import parallel
+
+NO_COMPRESSION = 0
+SPB_COMPRESSION = 1
+LZSS_COMPRESSION = 2
+NBZ_COMPRESSION = 4
+# compression of the uncompressed entries, given by their extension
+EXTENSION_COMPRESSION = {'.nbz': NBZ_COMPRESSION, '.spb': SPB_COMPRESSION}
+# archives of a game in the order they are searched, the first one having
+# a file providing it
+ARCHIVES = ['arc.nsa'] + ['arc%d.nsa' % i for i in range(1, 10)] + ['arc.sar']
+# dictionary of the LZSS compression
+LZSS_WINDOW = 256
+LZSS_MAX_LENGTH = 18
+
+IDENTIFIER = type_code("IDENTIFIER")
+STR = type_code("STR")
+STRALIAS = type_code("STRALIAS")
+
+# name as stored in the archive, offset of the data in the archive file,
+# length in the archive and once decompressed
+Entry = collections.namedtuple('Entry', 'name offset length original_length compression')
+
+class ArchiveError(Exception):
+    pass
+
+class BitReader(object):
+    """ Reads big-endian bit fields from `data`, starting at byte `offset`. """
+
+    def __init__(self, data, offset=0):
+        self.data = data
+        self.offset = offset
+        self.bits = 0
+        self.count = 0
+
+    def read(self, count):
+        while self.count < count:
+            if self.offset >= len(self.data):
+                raise EOFError()
+            self.bits = (self.bits << 8) | self.data[self.offset]
+            self.offset += 1
+            self.count += 8
+        self.count -= count
+        value = self.bits >> self.count
+        self.bits &= (1 << self.count) - 1
+        return value
+
+def decode_lzss(data, length):
+    """ Decode `length` bytes of LZSS: a set bit announces a literal byte, a
+        clear one an 8-bit offset in the dictionary and a 4-bit length.
+    """
+    output = bytearray()
+    window = bytearray(LZSS_WINDOW)
+    position = LZSS_WINDOW - LZSS_MAX_LENGTH
+    bits = BitReader(data)
+    try:
+        while len(output) < length:
+            if bits.read(1):
+                c = bits.read(8)
+                output.append(c)
+                window[position] = c
+                position = (position + 1) & (LZSS_WINDOW - 1)
+            else:
+                start = bits.read(8)
+                count = bits.read(4) + 2
+                for k in range(count):
+                    c = window[(start + k) & (LZSS_WINDOW - 1)]
+                    output.append(c)
+                    window[position] = c
+                    position = (position + 1) & (LZSS_WINDOW - 1)
+    except EOFError:
+        pass
+    return bytes(output[:length])
+
+def decode_spb(data):
+    """ Decode an SPB image into a 24-bit BMP. Each color channel is coded
+        separately as differences between consecutive pixels, the rows
+        being scanned alternately from left to right and right to left.
+    """
+    width, height = struct.unpack('>HH', data[:4])
+    stride = width * 3 + (4 - width * 3 % 4) % 4
+    size = stride * height + 54
+    output = bytearray(size)
+    struct.pack_into('<2sI4xIIiiHHII', output, 0, b'BM', size, 54, 40, width, height, 1, 24, 0, size - 54)
+
+    bits = BitReader(data, 4)
+    pixels = width * height
+    for channel in range(3):
+        values = bytearray()
+        try:
+            c = bits.read(8)
+            values.append(c)
+            while len(values) < pixels:
+                n = bits.read(3)
+                if n == 0:
+                    values.extend((c, c, c, c))
+                    continue
+                elif n == 7:
+                    m = bits.read(1) + 1
+                else:
+                    m = n + 2
+                for j in range(4):
+                    if m == 8:
+                        c = bits.read(8)
+                    else:
+                        k = bits.read(m)
+                        if k & 1:
+                            c = (c + (k >> 1) + 1) & 0xff
+                        else:
+                            c = (c - (k >> 1)) & 0xff
+                    values.append(c)
+        except EOFError:
+            values.extend(bytes(max(0, pixels - len(values))))
+
+        # the first row scanned is the top one, the last one of the bitmap
+        for row in range(height):
+            line = values[row * width:(row + 1) * width]
+            if row & 1:
+                line.reverse()
+            start = 54 + (height - 1 - row) * stride + channel
+            output[start:start + width * 3:3] = line
+    return bytes(output)
+
+def decode(data, entry):
+    """ Return the content of `entry`, from its raw `data`. """
+    if entry.compression == NO_COMPRESSION:
+        return data
+    elif entry.compression == SPB_COMPRESSION:
+        return decode_spb(data)
+    elif entry.compression == LZSS_COMPRESSION:
+        return decode_lzss(data, entry.original_length)
+    elif entry.compression == NBZ_COMPRESSION:
+        return bz2.decompress(data[4:])
+    raise ArchiveError('unknown compression %d of %s' % (entry.compression, entry.name))
+
+class Archive(object):
+    """ A memory-mapped .sar or .nsa archive, whose files are indexed by
+        normalized name (see assets.normalize).
+    """
+
+    def __init__(self, filename, encoding='cp932'):
+        self.filename = filename
+        self.encoding = encoding
+        self.entries = {}
+        self.file = open(filename, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.read_index(filename.lower().endswith('.nsa'))
+        except (ValueError, struct.error, UnicodeDecodeError) as e:
+            self.close()
+            raise ArchiveError('cannot read %s: %s' % (filename, e))
+
+    def read_index(self, nsa):
+        data = self.map
+        count, base = struct.unpack_from('>HI', data, 0)
+        offset = 6
+        for i in range(count):
+            end = data.find(b'\0', offset)
+            if end < 0:
+                raise ValueError('truncated index')
+            name = data[offset:end].decode(self.encoding)
+            offset = end + 1
+            if nsa:
+                compression, start, length, original_length = struct.unpack_from('>BIII', data, offset)
+                offset += 13
+            else:
+                start, length = struct.unpack_from('>II', data, offset)
+                compression, original_length = NO_COMPRESSION, length
+                offset += 8
+            if compression == NO_COMPRESSION:
+                compression = EXTENSION_COMPRESSION.get(os.path.splitext(name)[1].lower(), NO_COMPRESSION)
+            if base + start + length > len(data):
+                raise ValueError('%s is past the end of the archive' % name)
+            self.entries.setdefault(normalize(name), Entry(name, base + start, length, original_length, compression))
+
+    def close(self):
+        if getattr(self, 'map', None) is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def find(self, name):
+        """ Return the entry of the file `name`, or None. Sounds compressed
+            with bzip2 are stored with the .nbz extension.
+        """
+        key = normalize(name)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries.get(os.path.splitext(key)[0] + '.nbz')
+        return entry
+
+    def read(self, name):
+        """ Return the content of the file `name` of the archive. """
+        entry = self.find(name)
+        if entry is None:
+            raise KeyError(name)
+        return decode(self.map[entry.offset:entry.offset + entry.length], entry)
+
+class ArchiveSet(object):
+    """ Archives searched in order for the files of a game. """
+
+    def __init__(self, archives):
+        self.archives = archives
+
+    def close(self):
+        for archive in self.archives:
+            archive.close()
+
+    def find(self, name):
+        """ Return the (archive, entry) providing the file `name`, or None. """
+        for archive in self.archives:
+            entry = archive.find(name)
+            if entry is not None:
+                return archive, entry
+        return None
+
+    def read(self, name):
+        found = self.find(name)
+        if found is None:
+            raise KeyError(name)
+        return found[0].read(name)
+
+    def extract(self, names, destination, processes=None):
+        """ Extract the files `names` found in the archives to the
+            `destination` directory, in a pool of `processes`, skipping the
+            files already there. Return the paths of the files extracted.
+        """
+        jobs = []
+        for name in sorted(set(names)):
+            found = self.find(name)
+            if found is None:
+                continue
+            archive, entry = found
+            # an .nbz entry is extracted decompressed, under the name the
+            # script uses
+            if entry.compression == NBZ_COMPRESSION and normalize(entry.name) != normalize(name):
+                path = os.path.splitext(entry.name)[0] + os.path.splitext(name)[1]
+            else:
+                path = entry.name
+            path = os.path.join(destination, *path.replace('\\', '/').split('/'))
+            if not os.path.exists(path):
+                jobs.append((archive.filename, entry, path))
+
+        if len(jobs) <= 1 or processes == 1:
+            for job in jobs:
+                extract_entry(job)
+        else:
+            pool = multiprocessing.Pool(processes)
+            try:
+                for result in pool.imap_unordered(extract_entry, jobs, chunksize=16):
+                    pass
+            finally:
+                pool.terminate()
+                pool.join()
+        return [path for filename, entry, path in jobs]
+
+def find_directory(directory, path):
+    """ Return the directory `path` of the script, relative to `directory`.
+        Scripts are written for Windows, so its components are matched
+        whatever their case.
+    """
+    for part in path.replace('\\', '/').split('/'):
+        if part in ('', '.'):
+            continue
+        if os.path.isdir(directory):
+            names = dict((name.lower(), name) for name in os.listdir(directory))
+            part = names.get(part.lower(), part)
+        directory = os.path.join(directory, part)
+    return directory
+
+def open_archives(directory, nsadir=None, encoding='cp932'):
+    """ Return the ArchiveSet of the game `directory`, whose archives are in
+        the `nsadir` directory of the script if set, relative to it.
+    """
+    if nsadir:
+        directory = find_directory(directory, nsadir)
+    archives = []
+    if os.path.isdir(directory):
+        # archive names are matched whatever their case
+        files = dict((name.lower(), name) for name in os.listdir(directory))
+        for name in ARCHIVES:
+            if name in files:
+                archives.append(Archive(os.path.join(directory, files[name]), encoding))
+    return ArchiveSet(archives)
+
+# archives mapped by a process extracting their files
+_maps = {}
+
+def extract_entry(job):
+    filename, entry, path = job
+    data = _maps.get(filename)
+    if data is None:
+        with open(filename, 'rb') as input:
+            data = _maps[filename] = mmap.mmap(input.fileno(), 0, access=mmap.ACCESS_READ)
+    content = decode(data[entry.offset:entry.offset + entry.length], entry)
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # created by another process
+            if not os.path.isdir(directory):
+                raise
+    with open(path + '.tmp', 'wb') as output:
+        output.write(content)
+    os.rename(path + '.tmp', path)
+
+def find_files(parser, content):
+    """ Return the nsadir directory and the file paths of the tokenized
+        script: its string literals and string alias values, without the
+        display mode prefix of images.
+    """
+    straliases = {}
+    for line, table, alias, val in parallel.scan_aliases(parser, content):
+        if table == 'straliases':
+            straliases[alias] = val
+
+    nsadir = None
+    paths = set()
+    tokens = parser.tokens
+    for i, token in enumerate(tokens):
+        if token.code == STR:
+            literal = parser.escape(token)
+        elif token.code in (IDENTIFIER, STRALIAS) and token.value in straliases:
+            literal = straliases[token.value]
+        else:
+            if token.code == IDENTIFIER and token.value == 'nsadir' and i + 1 < len(tokens) and tokens[i + 1].code == STR:
+                nsadir = tokens[i + 1].value.strip('"')
+            continue
+        mode, path = split_image(literal)
+        if path:
+            paths.add(path)
+
+    return nsadir, paths
+
+def extract(parser, content, directory, destination, processes=None, encoding='cp932'):
+    """ Extract the files the tokenized script references from the archives
+        of the game `directory` to `destination`. Return the paths of the
+        files extracted.
+    """
+    nsadir, paths = find_files(parser, content)
+    archives = open_archives(directory, nsadir, encoding)
+    try:
+        return archives.extract(paths, destination, processes)
+    finally:
+        archives.close()
+
+if __name__ == '__main__':
+    import sys
+    from optparse import OptionParser
+
+    optparser = OptionParser('Usage: %prog [options] archive [name...]')
+    optparser.add_option('-o', '--output', dest='output', default=None,
+            help='extract the files to the OUTPUT directory instead of listing them')
+    optparser.add_option('-e', '--encoding', dest='encoding', default='cp932',
+            help='encoding of the file names [default: %default]')
+    (options, args) = optparser.parse_args()
+    if len(args) == 0:
+        optparser.print_usage()
+        sys.exit(-1)
+
+    archive = Archive(args[0], options.encoding)
+    names = args[1:] or [entry.name for entry in archive.entries.values()]
+    if options.output is None:
+        for name in names:
+            entry = archive.find(name)
+            if entry is not None:
+                print('%s\t%d\t%d\t%d' % (entry.name, entry.compression, entry.length, entry.original_length))
+    else:
+        ArchiveSet([archive]).extract(names, options.output)
+    archive.close()
@@ -0,0 +1,80 @@
+import os
+
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+
+IMAGE_EXTENSIONS = ('.bmp', '.png', '.jpg', '.jpeg', '.gif')
+MANIFEST_HEADER = """\
+# Generated by nscripter2renpy, do not edit.
+# Canonical path and size of the images, indexed by lowercase path.
+init -1 python:
+    ns_manifest = {
+"""
+
+def normalize(path):
+    """ Return the lookup key of a path of the script: scripts are written
+        for Windows, so paths use backslashes and ignore case.
+    """
+    path = path.replace('\\', '/').lower()
+    while path.startswith('./'):
+        path = path[2:]
+    return path
+
+class AssetIndex(object):
+    """ Index of the files of a game directory by normalized path, so that
+        the paths of the script can be resolved whatever their case. The
+        size of the images is read from their header, without decoding them.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.paths = {}
+        self.sizes = {}
+        self.scan()
+
+    def scan(self):
+        self.paths = {}
+        for root, dirs, files in os.walk(self.directory):
+            dirs.sort()
+            for filename in sorted(files):
+                path = os.path.relpath(os.path.join(root, filename), self.directory)
+                path = path.replace(os.sep, '/')
+                self.paths.setdefault(normalize(path), path)
+
+    def resolve(self, path):
+        """ Return the path of the file matching the script path `path`,
+            relative to the directory, or None if there is none.
+        """
+        return self.paths.get(normalize(path))
+
+    def size(self, path):
+        """ Return the (width, height) of the image at the script path
+            `path`, or None if it is missing or cannot be read.
+        """
+        key = normalize(path)
+        if not key in self.sizes:
+            self.sizes[key] = None
+            if key in self.paths:
+                try:
+                    image = Image.open(os.path.join(self.directory, self.paths[key]))
+                    self.sizes[key] = tuple(image.size)
+                except (IOError, ValueError):
+                    pass
+        return self.sizes[key]
+
+    def images(self):
+        """ Return the normalized paths of the images of the directory. """
+        return sorted(key for key in self.paths if os.path.splitext(key)[1] in IMAGE_EXTENSIONS)
+
+    def write_manifest(self, out):
+        """ Write the Ren'Py manifest of the images of the directory, read
+            by the runtime instead of loading the images for their size.
+        """
+        out.write(MANIFEST_HEADER)
+        for key in self.images():
+            size = self.size(key)
+            if size is not None:
+                out.write('        %r: (%r, %d, %d),\n' % (key, self.paths[key], size[0], size[1]))
+        out.write('    }\n')
@@ -0,0 +1,140 @@
+import hashlib, io, multiprocessing, os, re
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    import Image, ImageOps
+
+from assets import AssetIndex, IMAGE_EXTENSIONS
+from lexer import type_code
+import parallel
+
+# commands whose string arguments are images
+IMAGE_COMMANDS = ('bg', 'ld', 'lsp', 'setwindow')
+BAKED_DIR = 'baked'
+BAKED_SCRIPT = 'nscripter2renpy_baked.rpy'
+# screen size of the ;mode line starting the script
+MODES = {'320': (320, 240), '400': (400, 300), '640': (640, 480), '800': (800, 600)}
+DEFAULT_MODE = '640'
+
+IDENTIFIER = type_code("IDENTIFIER")
+SEP = type_code("SEP")
+STR = type_code("STR")
+STRALIAS = type_code("STRALIAS")
+
+def script_size(content):
+    """ Return the screen size the script was written for. """
+    match = re.match(r";\s*mode(\d+)", content)
+    if match is not None and match.group(1) in MODES:
+        return MODES[match.group(1)]
+    return MODES[DEFAULT_MODE]
+
+def find_images(parser, content):
+    """ Return the escaped image arguments of the tokenized script, the
+        same way Translator writes them, quotes and mode prefix included.
+    """
+    straliases = {}
+    for line, table, alias, val in parallel.scan_aliases(parser, content):
+        if table == 'straliases':
+            straliases[alias] = val
+
+    images = set()
+    tokens = parser.tokens
+    for i, token in enumerate(tokens):
+        if token.code != IDENTIFIER or not token.value in IMAGE_COMMANDS:
+            continue
+        for j in range(i + 1, len(tokens)):
+            arg = tokens[j]
+            if arg.line != token.line or arg.code == SEP:
+                break
+            if arg.code == STR:
+                images.add(parser.escape(arg))
+            elif arg.code in (IDENTIFIER, STRALIAS) and arg.value in straliases:
+                # aliases are lexed as identifiers, the parser types them
+                images.add(straliases[arg.value])
+
+    return images
+
+def split_image(image):
+    """ Return the (mode, path) of an escaped image argument. """
+    path = image.strip('"')
+    if path.startswith(':a;') or path.startswith(':c;'):
+        return path[1], path[3:]
+    return None, path
+
+def bake_image(job):
+    """ Convert an image to RGBA, using the right half of a split-alpha image
+        as its inverted mask, and scale it by the factors of the job.
+    """
+    source, mode, destination, factors = job
+    image = Image.open(source)
+    if mode == 'a':
+        width, height = image.size
+        mask = image.crop((width // 2, 0, width, height)).convert('L')
+        image = image.crop((0, 0, width // 2, height)).convert('RGBA')
+        image.putalpha(ImageOps.invert(mask))
+    else:
+        image = image.convert('RGBA')
+    size = (max(1, int(image.size[0] * factors[0])), max(1, int(image.size[1] * factors[1])))
+    if size != image.size:
+        if hasattr(Image, 'LANCZOS'):
+            image = image.resize(size, Image.LANCZOS)
+        else:
+            image = image.resize(size, Image.ANTIALIAS)
+    image.save(destination + '.tmp', 'PNG')
+    os.rename(destination + '.tmp', destination)
+
+def bake(parser, content, directory, screen, processes=None):
+    """ Bake the images of the tokenized script found in the game
+        `directory` for a `screen` of (width, height), in a pool of
+        `processes`. Baked images are named after the hash of their source,
+        so only new or modified images are baked again. Return the escaped
+        path of the baked image of each image argument, for Translator.baked.
+    """
+    width, height = script_size(content)
+    factors = (screen[0] / float(width), screen[1] / float(height))
+    index = AssetIndex(directory)
+    if not os.path.isdir(os.path.join(directory, BAKED_DIR)):
+        os.makedirs(os.path.join(directory, BAKED_DIR))
+
+    baked = {}
+    pending = {}
+    # baked images of split-alpha sources, half as wide as their source
+    split = set()
+    for image in find_images(parser, content):
+        mode, path = split_image(image)
+        if mode == 'c':
+            mode = None
+        source = index.resolve(path)
+        if source is None or not os.path.splitext(source)[1].lower() in IMAGE_EXTENSIONS:
+            continue
+        source = os.path.join(directory, source)
+        digest = hashlib.sha1()
+        with open(source, 'rb') as input:
+            digest.update(input.read())
+        digest.update(repr((mode, factors)).encode('utf8'))
+        name = '%s/%s.png' % (BAKED_DIR, digest.hexdigest())
+        baked[image] = '":b;%s"' % name
+        if mode == 'a':
+            split.add(name)
+        destination = os.path.join(directory, name)
+        if not os.path.exists(destination):
+            pending[destination] = (source, mode, destination, factors)
+
+    if len(pending) == 1:
+        bake_image(list(pending.values())[0])
+    elif pending:
+        pool = multiprocessing.Pool(processes)
+        try:
+            pool.map(bake_image, list(pending.values()))
+        finally:
+            pool.terminate()
+            pool.join()
+
+    # baked images are already scaled, but sprite positions still are at
+    # runtime, and standing images are placed from the width of their source
+    with io.open(os.path.join(directory, BAKED_SCRIPT), 'w', encoding='utf-8') as output:
+        output.write('init -1 python:\n    ns_scale = (%r, %r)\n' % factors)
+        output.write('    ns_baked_split = set(%r)\n' % sorted(split))
+
+    return baked
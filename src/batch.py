@@ -0,0 +1,228 @@
+""" Batch conversion of game directories.
+
+Each game is converted in a process of a pool to its own directory of the
+output directory, with the script, the log of the conversion and its state.
+A game is skipped when its script, the converter and the options are the
+same as the last time it was converted, so an interrupted batch can be run
+again. The summary of the batch is written to summary.json.
+"""
+import glob, hashlib, io, json, multiprocessing, os, sys, time
+from optparse import OptionParser
+
+import cache
+import nscripter2renpy
+from optimizer import PASSES
+from profiler import Profile
+
+SCRIPT_FILE = 'script.rpy'
+LOG_FILE = 'convert.log'
+STATE_FILE = 'state.json'
+SUMMARY_FILE = 'summary.json'
+# modules whose changes change the converted scripts
+SOURCES = ('lexer', 'parser', 'reader', 'writer', 'optimizer', 'nscripter2renpy')
+# options changing the converted scripts
+CONVERSION_OPTIONS = ('encoding', 'replace', 'optimize')
+
+def find_games(patterns, lists=()):
+    """ Return the game directories matching the glob `patterns` and listed
+        in the files `lists`, one per line, in order and without duplicates.
+    """
+    patterns = list(patterns)
+    for filename in lists:
+        with io.open(filename, encoding='utf-8') as input:
+            for line in input:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    patterns.append(line)
+
+    games = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) or [pattern]
+        for path in matches:
+            path = os.path.normpath(path)
+            if not path in games:
+                games.append(path)
+    return games
+
+def game_names(games):
+    """ Return the name of the output directory of each game, its directory
+        name with a number added when several games have the same.
+    """
+    names = []
+    for game in games:
+        base = os.path.basename(os.path.abspath(game)) or 'game'
+        name = base
+        number = 1
+        while name in names:
+            number += 1
+            name = '%s-%d' % (base, number)
+        names.append(name)
+    return names
+
+def input_hash(script, signature, options):
+    """ Hash the script, the converter and the conversion options. """
+    digest = hashlib.sha1(signature.encode('utf8'))
+    digest.update(repr([getattr(options, name) for name in CONVERSION_OPTIONS]).encode('utf8'))
+    with open(script, 'rb') as input:
+        digest.update(input.read())
+    return digest.hexdigest()
+
+def read_state(directory):
+    try:
+        with open(os.path.join(directory, STATE_FILE)) as input:
+            return json.load(input)
+    except (IOError, OSError, ValueError):
+        return {}
+
+def write_state(directory, state):
+    filename = os.path.join(directory, STATE_FILE)
+    with open(filename + '.tmp', 'w') as output:
+        json.dump(state, output, indent=2)
+        output.write('\n')
+    os.rename(filename + '.tmp', filename)
+
+def convert_game(job):
+    """ Convert a game, with its messages written to its log. Return the
+        result of the game for the summary; errors are reported in it.
+    """
+    game, directory, options, signature, force = job
+    result = {'game': game, 'output': directory, 'status': 'failed', 'time': 0.0,
+        'error': None, 'unknown_commands': {}, 'invalid_tokens': 0}
+    start = time.time()
+    script = os.path.join(game, 'nscript.dat')
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        digest = input_hash(script, signature, options)
+        state = read_state(directory)
+        if (not force and state.get('hash') == digest and state.get('status') == 'converted'
+                and os.path.exists(os.path.join(directory, SCRIPT_FILE))):
+            result.update(state.get('result', {}))
+            result['status'] = 'skipped'
+            result['time'] = time.time() - start
+            return result
+
+        options.output = os.path.join(directory, SCRIPT_FILE)
+        profile = Profile(script, memory=False)
+        stderr = sys.stderr
+        with io.open(os.path.join(directory, LOG_FILE), 'w', encoding='utf-8', errors='replace') as log:
+            sys.stderr = log
+            try:
+                success = nscripter2renpy.convert_to(script, options, profile=profile)
+            except Exception as e:
+                sys.stderr.write('Conversion failed: %s\n' % e)
+                success = False
+                result['error'] = '%s: %s' % (type(e).__name__, e)
+            finally:
+                sys.stderr = stderr
+
+        report = profile.report()
+        result['unknown_commands'] = dict((command['name'], command['count']) for command in report['unknown_commands'])
+        result['invalid_tokens'] = sum(token['count'] for token in report['invalid_tokens'])
+        if success:
+            result['status'] = 'converted'
+        elif result['error'] is None:
+            result['error'] = 'see %s' % os.path.join(directory, LOG_FILE)
+        result['time'] = time.time() - start
+        write_state(directory, {'hash': digest, 'status': result['status'], 'result': {
+            'unknown_commands': result['unknown_commands'], 'invalid_tokens': result['invalid_tokens']}})
+    except Exception as e:
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+        result['time'] = time.time() - start
+    return result
+
+def run(games, outdir, options, processes=None, force=False):
+    """ Convert the `games` to `outdir` in a pool of `processes` and return
+        the summary of the batch. A game failing does not stop the others.
+    """
+    signature = cache.code_signature(SOURCES)
+    jobs = [(game, os.path.join(outdir, name), options, signature, force)
+        for game, name in zip(games, game_names(games))]
+
+    start = time.time()
+    results = []
+    if processes == 1 or len(jobs) <= 1:
+        for job in jobs:
+            results.append(convert_game(job))
+            report_game(results[-1])
+    else:
+        # a new process for each game, so that the memory of a large
+        # script is released
+        pool = multiprocessing.Pool(processes, maxtasksperchild=1)
+        try:
+            for result in pool.imap_unordered(convert_game, jobs):
+                results.append(result)
+                report_game(result)
+        finally:
+            pool.terminate()
+            pool.join()
+    results.sort(key=lambda result: games.index(result['game']))
+
+    unknown = {}
+    for result in results:
+        for name, count in result['unknown_commands'].items():
+            unknown[name] = unknown.get(name, 0) + count
+    totals = dict((status, len([result for result in results if result['status'] == status]))
+        for status in ('converted', 'skipped', 'failed'))
+    totals['time'] = time.time() - start
+    totals['unknown_commands'] = dict(sorted(unknown.items(), key=lambda item: -item[1]))
+    return {'games': results, 'totals': totals}
+
+def report_game(result):
+    if result['error'] is not None:
+        sys.stderr.write('%-9s %s (%.2fs): %s\n' % (result['status'], result['game'], result['time'], result['error']))
+    else:
+        sys.stderr.write('%-9s %s (%.2fs)\n' % (result['status'], result['game'], result['time']))
+
+def write_summary(summary, outdir):
+    filename = os.path.join(outdir, SUMMARY_FILE)
+    with open(filename + '.tmp', 'w') as output:
+        json.dump(summary, output, indent=2)
+        output.write('\n')
+    os.rename(filename + '.tmp', filename)
+
+if __name__ == '__main__':
+    optparser = OptionParser('Usage: %prog [options] -o OUTDIR gamedir|pattern...')
+    optparser.add_option('-o', '--output-dir', dest='outdir', default=None,
+            help='write each game to a directory of OUTDIR')
+    optparser.add_option('-l', '--list', dest='lists', action='append', default=[],
+            help='convert the game directories listed in LIST, one per line')
+    optparser.add_option('-j', '--jobs', dest='jobs', type='int', default=0,
+            help='convert JOBS games at once, 0 for one per CPU [default: %default]')
+    optparser.add_option('-f', '--force', dest='force', action='store_true', default=False,
+            help='convert the games again even if they did not change')
+    optparser.add_option('-e', '--encoding', dest='encoding', default='cp932',
+            help='script encoding [default: %default]')
+    optparser.add_option('-r', '--replace', dest='replace', action='store_true', default=False,
+            help='replace undecodable bytes instead of aborting')
+    optparser.add_option('-O', '--optimize', dest='optimize', default='',
+            help='comma-separated optimizations of the generated statements, among %s, or all' % ', '.join(PASSES))
+    optparser.add_option('-t', '--parse-cache', dest='parse_cache', default=None,
+            help='keep the lexed scripts in the PARSE_CACHE directory, by content hash')
+    (batch_options, args) = optparser.parse_args()
+
+    if batch_options.outdir is None or (not args and not batch_options.lists):
+        optparser.print_usage()
+        sys.exit(-1)
+    if batch_options.jobs < 0:
+        optparser.error('--jobs must not be negative')
+
+    # the options of a single conversion
+    options = nscripter2renpy.option_parser().get_default_values()
+    for name in ('encoding', 'replace', 'optimize', 'parse_cache'):
+        setattr(options, name, getattr(batch_options, name))
+    nscripter2renpy.check_options(optparser, options)
+
+    games = find_games(args, batch_options.lists)
+    if not os.path.isdir(batch_options.outdir):
+        os.makedirs(batch_options.outdir)
+    summary = run(games, batch_options.outdir, options, batch_options.jobs or None, batch_options.force)
+    write_summary(summary, batch_options.outdir)
+
+    totals = summary['totals']
+    sys.stderr.write('%d converted, %d skipped, %d failed in %.2fs\n' % (
+        totals['converted'], totals['skipped'], totals['failed'], totals['time']))
+    for name, count in list(totals['unknown_commands'].items())[:10]:
+        sys.stderr.write('  unknown command %s: %d\n' % (name, count))
+    if totals['failed']:
+        sys.exit(1)
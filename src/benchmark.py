@@ -0,0 +1,351 @@
+""" Benchmarks of the conversion on synthetic scripts.
+
+    python benchmark.py [--sizes 100K,1M,10M,50M] [--save]
+
+Scripts are generated once in a temporary directory and reused. Each phase
+is timed on its own, keeping the best of a few runs, then run again under
+tracemalloc for its peak memory. The results are compared with the
+baselines of test/benchmark.json, which --save replaces.
+"""
+import gc, json, os, random, sys, tempfile, time, tracemalloc
+from optparse import OptionParser
+
+from parser import Parser, Translator
+from reader import ScriptReader, DECRYPT_TABLE
+from writer import Writer
+
+SEED = 1
+SIZES = ['100K', '1M', '10M', '50M']
+BASELINES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test', 'benchmark.json')
+# a phase is reported as a regression when it is this much slower than its baseline
+TOLERANCE = 1.25
+REPEAT = 3
+
+WORDS = ['the', 'night', 'was', 'quiet', 'and', 'she', 'looked', 'at', 'me', 'again',
+         '彼女は', '静かに', '笑った', '。',
+         '「ありがとう」', '夜', 'の', '学校']
+NUMALIASES = ['fade', 'slow', 'quick', 'hero', 'heroine', 'friend', 'cursor', 'button']
+STRALIASES = ['room', 'street', 'school', 'night', 'theme', 'battle', 'door', 'steps']
+
+def parse_size(size):
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    if size[-1:].upper() in units:
+        return int(float(size[:-1]) * units[size[-1].upper()])
+    return int(size)
+
+class ScriptGenerator(object):
+    """ Generates a script of label blocks made of random statements. Every
+        command known to the translator is used, along with aliases, skips,
+        conditions and menus, in proportions close to those of a game:
+        mostly text, then images and sounds.
+    """
+
+    def __init__(self, seed=SEED):
+        self.random = random.Random(seed)
+        self.labels = 0
+        self.statements = [
+            (40, self.text), (6, self.image), (5, self.sprite), (4, self.sound),
+            (4, self.wait), (4, self.variable), (3, self.condition), (2, self.jump),
+            (1, self.menu), (1, self.skip), (1, self.misc),
+        ]
+        self.total = sum(weight for weight, statement in self.statements)
+
+    def header(self):
+        lines = ['; generated by benchmark.py', '*define']
+        for i, alias in enumerate(NUMALIASES):
+            lines.append('numalias %s,%d' % (alias, i + 10))
+        for alias in STRALIASES:
+            lines.append('stralias %s,"data\\%s.bmp"' % (alias, alias))
+        lines += [
+            'caption "Benchmark"', 'versionstr "benchmark","1.0"',
+            'effect 10,10,500', 'effect 11,18,800,"mask\\wipe.bmp"', 'effect 12,10,300',
+            'setwindow 10,20,30,30,20,20,0,0,10,0,1,#999999,0,0,639,479',
+            'menusetwindow 18,18,2,2,0,1,#ffffff', 'selectcolor #ffffff,#999999',
+            'menuselectcolor #ffffff,#999999,#000000', 'rmenu `Save`,save,`Load`,load',
+            'savenumber 10', 'savename "save","load","slot"',
+            'lookbackbutton "a.bmp","b.bmp","c.bmp","d.bmp"', 'lookbackcolor #ffff00',
+            'clickstr "。」",1', 'nsa', 'nsadir "data"', 'globalon', 'filelog',
+            'trap *l0', 'game',
+        ]
+        return lines
+
+    def block(self, label):
+        lines = ['', '*l%d' % label]
+        for i in range(self.random.randint(20, 60)):
+            lines += self.statement()
+        if self.random.random() < 0.1:
+            lines.append('return')
+        return lines
+
+    def statement(self):
+        choice = self.random.randrange(self.total)
+        for weight, statement in self.statements:
+            if choice < weight:
+                return statement()
+            choice -= weight
+
+    def label(self):
+        """ A label of the blocks already written or of the next ones. """
+        return '*l%d' % self.random.randrange(self.labels + 5)
+
+    def sentence(self):
+        words = [self.random.choice(WORDS) for i in range(self.random.randint(3, 14))]
+        return ' '.join(words)
+
+    def number(self):
+        if self.random.random() < 0.2:
+            return self.random.choice(NUMALIASES)
+        return str(self.random.randint(0, 1000))
+
+    def text(self):
+        end = self.random.choice(['@', '\\', '', '@'])
+        line = '`' + self.sentence() + end
+        if self.random.random() < 0.1:
+            return [line, 'br']
+        return [line]
+
+    def image(self):
+        r = self.random
+        effect = r.choice(['10', '11', '12', 'fade'])
+        return [r.choice([
+            'bg "data\\bg%d.bmp",%s' % (r.randrange(100), effect),
+            'bg %s,%s' % (r.choice(STRALIASES), effect),
+            'bg %s,%s' % (r.choice(['black', 'white', '#102030']), effect),
+            'ld %s,":a;data\\ch%d.bmp",%s' % (r.choice('lcr'), r.randrange(50), effect),
+            'cl %s,%s' % (r.choice(['l', 'c', 'r', 'a']), effect),
+            'print %s' % effect,
+            'monocro #%06x' % r.randrange(1 << 24),
+            'quakex %d,%d' % (r.randint(1, 9), r.randint(100, 900)),
+            'quakey %d,%d' % (r.randint(1, 9), r.randint(100, 900)),
+            'effectblank %d' % r.randint(0, 100),
+            'windoweffect %d,%d' % (r.randint(1, 18), r.randint(100, 900)),
+        ])]
+
+    def sprite(self):
+        r = self.random
+        sprite = r.randrange(20)
+        return [r.choice([
+            'lsp %d,":a;data\\sp%d.bmp",%d,%d' % (sprite, r.randrange(50), r.randrange(640), r.randrange(480)),
+            'lsp %d,":a;data\\sp%d.bmp",%d,%d,%d' % (sprite, r.randrange(50), r.randrange(640), r.randrange(480), r.randrange(256)),
+            'msp %d,%d,%d' % (sprite, r.randint(-50, 50), r.randint(-50, 50)),
+            'msp %d,%d,%d,%d' % (sprite, r.randint(-50, 50), r.randint(-50, 50), r.randint(-64, 64)),
+            'vsp %d,%d' % (sprite, r.randint(0, 1)),
+            'csp %d' % r.choice([sprite, -1]),
+        ])]
+
+    def sound(self):
+        r = self.random
+        return [r.choice([
+            'play "*%d"' % r.randint(1, 20), 'playstop',
+            'wave "se\\s%d.wav"' % r.randrange(40), 'waveloop "se\\l%d.wav"' % r.randrange(10),
+            'wavestop', 'stop',
+        ])]
+
+    def wait(self):
+        r = self.random
+        return [r.choice([
+            'wait %d' % r.randint(100, 2000), 'delay %d' % r.randint(100, 2000),
+            '!w%d' % r.randint(100, 2000), '!d%d' % r.randint(100, 2000),
+            '!s%d' % r.randint(0, 50), '!sd', 'click', 'textclear', 'textoff', 'texton',
+            'resettimer', 'waittimer %d' % r.randint(100, 2000), 'repaint',
+            'autoclick %d' % r.randint(0, 500),
+        ])]
+
+    def variable(self):
+        r = self.random
+        var = '%%%d' % r.randrange(200)
+        return [r.choice([
+            'mov %s,%s' % (var, self.number()),
+            'mov $%d,"%s"' % (r.randrange(100), r.choice(WORDS)),
+            'mov $%d,%s' % (r.randrange(100), r.choice(STRALIASES)),
+            'add %s,%s' % (var, self.number()),
+            'add $%d,"%s"' % (r.randrange(100), r.choice(WORDS)),
+            'sub %s,%s' % (var, self.number()),
+            'inc %s' % var, 'dec %s' % var,
+            'cmp %s,"%s","%s"' % (var, r.choice(WORDS), r.choice(WORDS)),
+            'date %%%d,%%%d,%%%d' % (r.randrange(200), r.randrange(200), r.randrange(200)),
+        ])]
+
+    def condition(self):
+        r = self.random
+        var = '%%%d' % r.randrange(200)
+        op = r.choice(['==', '!=', '<', '<=', '>', '>='])
+        return [r.choice([
+            'if %s %s %s goto %s' % (var, op, self.number(), self.label()),
+            'if %s %s %d && %%%d < %d mov %s,0:inc %%%d' % (var, op, r.randrange(100), r.randrange(200), r.randrange(100), var, r.randrange(200)),
+            'notif %s %s %d goto %s' % (var, op, r.randrange(100), self.label()),
+            'if fchk "data\\bg%d.bmp" gosub %s' % (r.randrange(100), self.label()),
+        ])]
+
+    def jump(self):
+        r = self.random
+        return [r.choice(['goto %s', 'gosub %s', 'trap %s']) % self.label()]
+
+    def menu(self):
+        choices = ['`%s`,%s' % (self.sentence(), self.label()) for i in range(self.random.randint(2, 4))]
+        return [self.random.choice(['select ', 'selgosub ']) + ','.join(choices)]
+
+    def skip(self):
+        skip = self.random.randint(1, 4)
+        return ['skip %d' % (skip + 1)] + [self.text()[0] for i in range(skip)] + self.text()
+
+    def misc(self):
+        r = self.random
+        return [r.choice([
+            'btndef "data\\btn%d.bmp"' % r.randrange(10),
+            'btn %d,0,0,100,20,0,%d' % (r.randint(1, 9), r.randrange(400)),
+            'btnwait %%%d' % r.randrange(200),
+            'setcursor 0,"cursor%d.bmp",0,0' % r.randrange(3),
+            'systemcall %s' % r.choice(['lookback', 'load', 'rmenu']),
+        ])]
+
+    def lines(self, size):
+        """ Yield the lines of a script of about `size` characters. """
+        written = 0
+        for line in self.header():
+            written += len(line) + 1
+            yield line
+        while written < size:
+            for line in self.block(self.labels):
+                written += len(line) + 1
+                yield line
+            self.labels += 1
+        yield 'end'
+
+def generate(filename, size, seed=SEED, encoding='cp932'):
+    """ Write an encrypted nscript.dat of about `size` bytes. """
+    generator = ScriptGenerator(seed)
+    with open(filename + '.tmp', 'wb') as output:
+        parts = []
+        for line in generator.lines(size):
+            parts.append(line)
+            if len(parts) == 4096:
+                output.write(('\n'.join(parts) + '\n').encode(encoding).translate(DECRYPT_TABLE))
+                parts = []
+        output.write(('\n'.join(parts) + '\n').encode(encoding).translate(DECRYPT_TABLE))
+    os.rename(filename + '.tmp', filename)
+
+class NullOutput(object):
+    def write(self, text):
+        pass
+
+def phases(filename, state):
+    """ Yield the (name, function) of each phase of a conversion, each
+        function using the results of the previous ones kept in `state`.
+    """
+    def read():
+        state['content'] = ScriptReader(filename).read()
+
+    def tokenize():
+        state['parser'] = Parser()
+        state['parser'].tokenize(state['content'])
+        state['tokens'] = len(state['parser'].tokens)
+
+    def translate():
+        out = Writer(NullOutput())
+        Translator(state['parser'], out).translate()
+        out.flush()
+
+    return [('read', read), ('tokenize', tokenize), ('translate', translate)]
+
+def measure(filename, memory=True, repeat=REPEAT):
+    """ Return the results of the benchmark of `filename`: the best time of
+        each phase over `repeat` runs in seconds, the number of tokens, the
+        tokens lexed per second and, with `memory`, the peak memory of each
+        phase in bytes.
+    """
+    state = {}
+    result = {'size': os.path.getsize(filename), 'time': {}}
+    for i in range(repeat):
+        state.clear()
+        for name, phase in phases(filename, state):
+            gc.collect()
+            start = time.perf_counter()
+            phase()
+            elapsed = time.perf_counter() - start
+            result['time'][name] = min(elapsed, result['time'].get(name, elapsed))
+    result['tokens'] = state['tokens']
+    result['tokens_per_second'] = state['tokens'] / result['time']['tokenize']
+
+    if memory:
+        state.clear()
+        result['peak'] = {}
+        tracemalloc.start()
+        try:
+            for name, phase in phases(filename, state):
+                gc.collect()
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                phase()
+                result['peak'][name] = tracemalloc.get_traced_memory()[1] - base
+        finally:
+            tracemalloc.stop()
+
+    return result
+
+def load_baselines(filename=BASELINES):
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as input:
+        return json.load(input)
+
+def save_baselines(baselines, filename=BASELINES):
+    with open(filename, 'w') as output:
+        json.dump(baselines, output, indent=2, sort_keys=True)
+        output.write('\n')
+
+def report(size, result, baseline=None):
+    """ Print the results of a benchmark and return the phases that are
+        slower than their baseline.
+    """
+    regressions = []
+    print('%s: %d bytes, %d tokens, %.0f tokens/s' % (size, result['size'], result['tokens'], result['tokens_per_second']))
+    for name in sorted(result['time'], key=list(result['time']).index):
+        line = '  %-10s %8.3fs' % (name, result['time'][name])
+        if 'peak' in result:
+            line += ' %10.1f MB' % (result['peak'][name] / float(1 << 20))
+        if baseline is not None and name in baseline['time']:
+            ratio = result['time'][name] / baseline['time'][name]
+            line += '  x%.2f' % ratio
+            if ratio > TOLERANCE:
+                line += ' REGRESSION'
+                regressions.append((size, name))
+        print(line)
+    return regressions
+
+if __name__ == '__main__':
+    optparser = OptionParser(usage='usage: %prog [options]')
+    optparser.add_option('--sizes', dest='sizes', default=','.join(SIZES),
+            help='comma-separated sizes of the scripts (default: %default)')
+    optparser.add_option('--seed', dest='seed', type='int', default=SEED,
+            help='seed of the script generator (default: %default)')
+    optparser.add_option('-d', '--dir', dest='dir', default=os.path.join(tempfile.gettempdir(), 'nscripter2renpy-benchmark'),
+            help='directory of the generated scripts (default: %default)')
+    optparser.add_option('-n', '--repeat', dest='repeat', type='int', default=REPEAT,
+            help='number of runs of which the best time is kept (default: %default)')
+    optparser.add_option('--no-memory', dest='memory', action='store_false', default=True,
+            help='do not measure the peak memory, which takes a second run')
+    optparser.add_option('--save', dest='save', action='store_true', default=False,
+            help='store the results as the new baselines')
+    (options, args) = optparser.parse_args()
+
+    baselines = load_baselines()
+    regressions = []
+    for size in options.sizes.split(','):
+        # one game directory per script, so that it can be converted too
+        directory = os.path.join(options.dir, '%s-%d' % (size, options.seed))
+        filename = os.path.join(directory, 'nscript.dat')
+        if not os.path.exists(filename):
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            generate(filename, parse_size(size), options.seed)
+        result = measure(filename, options.memory, options.repeat)
+        key = '%s-%d' % (size, options.seed)
+        regressions += report(size, result, baselines.get(key))
+        if options.save:
+            baselines[key] = result
+
+    if options.save:
+        save_baselines(baselines)
+    if regressions:
+        sys.exit(1)
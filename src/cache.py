@@ -0,0 +1,102 @@
+import hashlib, os, pickle
+
+import parallel
+from parser import Translator
+
+CACHE_FILE = 'blocks.pickle'
+
+def code_signature(modules=('lexer', 'parser', 'parallel')):
+    """ Hash the sources of the translator `modules`, so that the cache is
+        dropped when the translation changes.
+    """
+    digest = hashlib.sha1()
+    for module in modules:
+        filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), module + '.py')
+        with open(filename, 'rb') as input:
+            digest.update(input.read())
+    return digest.hexdigest()
+
+def task_key(task):
+    """ Return the cache key of a parallel task. The output of a block does
+        not depend on where it starts, so skip lines are made relative to its
+        first line and inserting lines above it keeps it cached.
+    """
+    text, lineno, numaliases, straliases, skiplabel, skips, flush = task
+    relative = sorted([(skipto - lineno, label) for skipto, label in skiplabel.items()])
+    data = repr((sorted(numaliases.items()), sorted(straliases.items()), relative, [skipto - lineno for skipto in skips], flush))
+    digest = hashlib.sha1(text.encode('utf8'))
+    digest.update(data.encode('utf8'))
+    return digest.hexdigest()
+
+class BlockCache(object):
+    """ Translated label blocks indexed by the hash of their source and of
+        the aliases and skip labels they depend on. The cache is saved in
+        `directory`, or only kept in memory if it is None.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.signature = code_signature()
+        self.blocks = {}
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        if self.directory is None:
+            return
+        filename = os.path.join(self.directory, CACHE_FILE)
+        if not os.path.exists(filename):
+            return
+        try:
+            with open(filename, 'rb') as input:
+                signature, blocks = pickle.load(input)
+        except (EOFError, ValueError, pickle.UnpicklingError):
+            return
+        if signature == self.signature:
+            self.blocks = blocks
+
+    def save(self):
+        if self.directory is None:
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        filename = os.path.join(self.directory, CACHE_FILE)
+        with open(filename + '.tmp', 'wb') as output:
+            pickle.dump((self.signature, self.blocks), output, pickle.HIGHEST_PROTOCOL)
+        os.rename(filename + '.tmp', filename)
+
+    def translate(self, parser, content, out, jobs=None):
+        """ Translate `content` like parallel.translate, only translating
+            the blocks that are not in the cache, in `jobs` processes if it
+            is not None. Blocks that are no longer used are dropped from
+            the cache.
+        """
+        translator = Translator(parser, out)
+        translator.write_header()
+
+        tasks = list(parallel.tasks(parser, content, task_lines=1))
+        keys = [task_key(task) for task in tasks]
+        missing = [i for i, key in enumerate(keys) if not key in self.blocks]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            if jobs is None:
+                results = map(parallel.translate_task, [tasks[i] for i in missing])
+            else:
+                results = parallel.translate_tasks([tasks[i] for i in missing], jobs or None)
+            for i, result in zip(missing, results):
+                self.blocks[keys[i]] = result
+
+        for key in keys:
+            output, sizes, effects = self.blocks[key]
+            out.write(output)
+            parser.merge_sizes(sizes)
+            translator.effects.update(effects)
+        translator.write_footer()
+
+        changed = missing or len(self.blocks) != len(set(keys))
+        self.blocks = dict((key, self.blocks[key]) for key in keys)
+        if changed:
+            self.save()
@@ -1,6 +1,11 @@
 # Adapted from http://www.evanfosmark.com/2009/02/sexy-lexing-with-python/
 
 import re, sys
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
  
  
 class UnknownTokenError(Exception):
@@ -21,23 +26,33 @@ class _InputScanner(object):
         returned when scan() is called. It is built to be great for iteration. This is
         mainly to be used by the Lexer and ideally not directly.
     """
- 
+
     def __init__(self, lexer, input):
-        """ Put the lexer into this instance so the callbacks can reference it 
-            if needed.
+        """ Put the lexer into this instance so the callbacks can reference it
+            if needed. `input` is either a string or an iterable of strings,
+            in which case it is only buffered `lexer.lookahead` characters
+            at a time.
         """
         self._position = 0
         self.lineno = 1
         self.lexer = lexer
-        self.input = input
- 
+        if isinstance(input, str):
+            self._chunks = None
+            self.input = input
+        else:
+            self._chunks = iter(input)
+            self.input = ''
+        self._last_newline = -1
+        self.index_lines()
+        self._tokens = self.tokens()
+
     def __iter__(self):
         """ All of the code for iteration is controlled by the class itself.
             This and next() (or __next__() in Python 3.0) are so syntax
             like `for token in Lexer(...):` is valid and works.
         """
         return self
- 
+
     def next(self):
         return self.__next__()
 
@@ -45,83 +60,354 @@ class _InputScanner(object):
         """ Used for iteration. It returns token after token until there
             are no more tokens. (change this to __next__(self) if using Py3.0)
         """
-        if not self.done_scanning():
-            return self.scan_next()
-        raise StopIteration
- 
+        return next(self._tokens)
+
     def done_scanning(self):
         """ A simple boolean function that returns true if scanning is
             complete and false if it isn't.
         """
-        return self._position >= len(self.input)
- 
+        return self._position >= len(self.input) and self._chunks is None
+
+    def index_lines(self):
+        """ Build the offsets of the line breaks of the buffer, from which
+            the line numbers of the tokens are computed.
+        """
+        self._newlines = [match.start() for match in re.finditer("\n", self.input)]
+        self._newlines.append(len(self.input))
+        self._next_newline = 0
+        if len(self._newlines) > 1:
+            self._last_newline = self._newlines[-2]
+        else:
+            self._last_newline = -1
+
+    def refill(self):
+        """ Drop the consumed input and append chunks to the buffer until at
+            least `lexer.lookahead` characters are left to scan and the buffer
+            ends on a complete line, or the input is exhausted. At least one
+            chunk is read on each call.
+        """
+        self.update_lineno()
+        parts = [self.input[self._position:]]
+        size = len(parts[0])
+        while True:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._chunks = None
+                break
+            parts.append(chunk)
+            size += len(chunk)
+            if size >= self.lexer.lookahead and "\n" in chunk:
+                break
+        self.input = ''.join(parts)
+        self._position = 0
+        self.index_lines()
+
+    def update_lineno(self):
+        """ Count the line breaks between the previous token and the
+            current position.
+        """
+        newlines = self._newlines
+        i = self._next_newline
+        while newlines[i] < self._position:
+            i += 1
+        self.lineno += i - self._next_newline
+        self._next_newline = i
+
     def scan_next(self):
-        """ Retreive the next token from the input. If the
-            flag `omit_whitespace` is set to True, then it will
-            skip over the whitespace characters present.
+        """ Retreive the next token from the input, or None when scanning
+            is complete.
         """
-        if self.done_scanning():
-            return None
-        if self.lexer.omit_whitespace:
-            match = self.lexer.ws_regexc.match(self.input, self._position)
-            if match:
-                self._position = match.end()
-                self.lineno += self.input[match.start():match.end()].count("\n")
+        return next(self._tokens, None)
+
+    def tokens(self):
+        """ Generate the tokens of the input. If the flag `omit_whitespace`
+            is set to True, then it will skip over the whitespace characters
+            present. The scanning loop works on local variables and only
+            saves its state when the buffer has to be refilled.
+        """
+        lexer = self.lexer
+        dispatch = lexer.dispatch
+        default = lexer.default
+        ws_match = lexer.ws_regexc.match
+        omit_whitespace = lexer.omit_whitespace
+        incomplete = False
+        while True:
+            if self._chunks is not None and (incomplete or self._last_newline < self._position):
+                # tokens never span lines, so scanning needs a complete line
+                self.refill()
+            incomplete = False
+            input = self.input
+            end = len(input)
+            position = self._position
+            newlines = self._newlines
+            next_newline = self._next_newline
+            lineno = self.lineno
+            chunked = self._chunks is not None
+            last_newline = self._last_newline
+
+            while position < end:
+                char = input[position]
+                if omit_whitespace and char.isspace():
+                    match_end = ws_match(input, position).end()
+                    if chunked and match_end == end:
+                        incomplete = True
+                        break
+                    position = match_end
+                    if position == end:
+                        break
+                    char = input[position]
+                if chunked and position > last_newline:
+                    break
+                regexc, rules = dispatch.get(char, default)
+                match = regexc.match(input, position)
+                while newlines[next_newline] < position:
+                    next_newline += 1
+                    lineno += 1
+                if match is None:
+                    self.lineno = lineno
+                    raise UnknownTokenError(char, lineno)
+                match_end = match.end()
+                if chunked and match_end == end:
+                    incomplete = True
+                    break
+                position = match_end
+                group = match.lastindex
+                code, callback = rules[group]
+                value = match.group(group)
+                if callback is not None:
+                    self.lineno = lineno
+                    value = callback(self, value, lineno)
+                self._position = position
+                yield Token(code, value, lineno)
+
+            self._position = position
+            self._next_newline = next_newline
+            self.lineno = lineno
             if self.done_scanning():
-                return None
-        match = self.lexer.regexc.match(self.input, self._position)
-        if match is None:
-            raise UnknownTokenError(self.input[self._position], self.lineno)
-        self._position = match.end()
-        value = match.group(match.lastgroup)
-        if match.lastgroup in self.lexer._callbacks:
-            value = self.lexer._callbacks[match.lastgroup](self, value, self.lineno)
-        return Token(match.lastgroup, value, self.lineno)
- 
+                return
+
+# token type names, indexed by their integer code
+TYPES = []
+CODES = {}
+
+def type_code(name):
+    """ Return the integer code of the token type `name`, interning it if
+        it is new.
+    """
+    code = CODES.get(name)
+    if code is None:
+        code = CODES[name] = len(TYPES)
+        TYPES.append(name)
+    return code
+
+def type_mask(names):
+    """ Return the bitmask matching a token type name or a list of names. """
+    if isinstance(names, str):
+        names = [names]
+    mask = 0
+    for name in names:
+        mask |= 1 << type_code(name)
+    return mask
+
+def mask_types(mask):
+    """ Return the names of the token types matched by `mask`. """
+    return [name for code, name in enumerate(TYPES) if mask & (1 << code)]
+
 class Token(object):
+    """ A token of the input. Its type is stored as an interned integer
+        code; `escaped` is computed on first access by `escaper`, if set.
+    """
+    __slots__ = ('code', 'value', 'line', 'escaper', '_escaped')
+
     def __init__(self, type, value, line):
-        self.type = type
+        if isinstance(type, int):
+            self.code = type
+        else:
+            self.code = type_code(type)
         self.value = value
         self.line = line
-        self.escaped = value
+        self.escaper = None
+        self._escaped = None
+
+    @property
+    def type(self):
+        return TYPES[self.code]
+
+    @type.setter
+    def type(self, name):
+        self.code = type_code(name)
+        self._escaped = None
+
+    @property
+    def escaped(self):
+        if self._escaped is None:
+            if self.escaper is None:
+                return self.value
+            self._escaped = self.escaper(self)
+        return self._escaped
+
+    @escaped.setter
+    def escaped(self, value):
+        self._escaped = value
+
+    def __reduce__(self):
+        # type codes are only meaningful within a process
+        return (Token, (self.type, self.value, self.line))
 
     def __hash__(self):
-        return self.__repr__().__hash__()
+        return hash((self.code, self.value))
 
     def __eq__(self, other):
-        return self.__repr__() == other.__repr__()
+        if not isinstance(other, Token):
+            return NotImplemented
+        return self.code == other.code and self.value == other.value
 
     def __repr__(self):
         return '<Token type=%s, value=%s>' % (self.type, self.value)
 
+def first_chars(pattern):
+    """ Return the set of ASCII characters a match of `pattern` can start
+        with, in any case, or None if the pattern can match the empty string,
+        start with another character or is too complex to analyze.
+    """
+    try:
+        chars, nullable = _first_chars(sre_parse.parse(pattern))
+    except Exception:
+        return None
+    if chars is None or nullable:
+        return None
+    for char in list(chars):
+        if ord(char) >= 128:
+            return None
+        chars.add(char.lower())
+        chars.add(char.upper())
+    return chars
+
+def _first_chars(items):
+    """ Return (chars, nullable) for a parsed sequence, chars being None
+        when any character could start it.
+    """
+    chars = set()
+    for op, av in items:
+        first, nullable = _first_chars_op(op, av)
+        if first is None:
+            return None, False
+        chars |= first
+        if not nullable:
+            return chars, False
+    return chars, True
+
+def _first_chars_op(op, av):
+    if op is sre_parse.LITERAL:
+        return set([chr(av)]), False
+    elif op is sre_parse.IN:
+        chars = set()
+        for item, value in av:
+            if item is sre_parse.LITERAL:
+                chars.add(chr(value))
+            elif item is sre_parse.RANGE and value[1] < 128:
+                chars.update(chr(c) for c in range(value[0], value[1] + 1))
+            else:
+                return None, False
+        return chars, False
+    elif op is sre_parse.BRANCH:
+        chars = set()
+        nullable = False
+        for branch in av[1]:
+            first, empty = _first_chars(branch)
+            if first is None:
+                return None, False
+            chars |= first
+            nullable = nullable or empty
+        return chars, nullable
+    elif op is sre_parse.SUBPATTERN:
+        return _first_chars(av[-1])
+    elif op in _REPEATS:
+        first, nullable = _first_chars(av[2])
+        return first, nullable or av[0] == 0
+    elif op is sre_parse.AT:
+        return set(), True
+    return None, False
+
+_REPEATS = [sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT]
+if hasattr(sre_parse, 'POSSESSIVE_REPEAT'):
+    _REPEATS.append(sre_parse.POSSESSIVE_REPEAT)
+
+_dispatch_tables = {}
+
+def dispatch_table(rules):
+    """ Return the (char, indexes of the rules it can start) pairs of the
+        ASCII characters. Tables are cached as analyzing rules is slow.
+    """
+    key = tuple(rules)
+    if not key in _dispatch_tables:
+        firsts = [first_chars(rule) for rule in rules]
+        table = []
+        for c in range(128):
+            char = chr(c)
+            table.append((char, tuple(i for i, first in enumerate(firsts) if first is None or char in first)))
+        _dispatch_tables[key] = table
+    return _dispatch_tables[key]
+
 class Lexer(object):
     """ A lexical scanner. It takes in an input and a set of rules based
         on reqular expressions. It then scans the input and returns the
         tokens one-by-one. It is meant to be used through iterating.
+
+        Rules are dispatched on the first character of each token: only the
+        rules that can start with it are tried, and the other ones are left
+        out of the alternation. Rules keep their order, so the same rule wins
+        as with the full regular expression.
     """
- 
-    def __init__(self, rules, case_sensitive=True, omit_whitespace=True):
-        """ Set up the lexical scanner. Build and compile the regular expression
-            and prepare the whitespace searcher.
+
+    def __init__(self, rules, case_sensitive=True, omit_whitespace=True, lookahead=65536):
+        """ Set up the lexical scanner. Build and compile the regular expressions
+            for each first character and prepare the whitespace searcher.
         """
         self._callbacks = {}
+        self._codes = {}
+        self._rules = []
+        self.lookahead = lookahead
         self.omit_whitespace = omit_whitespace
         self.case_sensitive = case_sensitive
-        parts = []
         for name, rule in rules:
+            callback = None
             if not isinstance(rule, str):
                 rule, callback = rule
                 self._callbacks[name] = callback
-            parts.append("(?P<%s>%s)" % (name, rule))
+            self._codes[name] = type_code(name)
+            self._rules.append((name, rule, self._codes[name], callback))
         if self.case_sensitive:
-            flags = re.M
+            self.flags = re.M
         else:
-            flags = re.M|re.I
-        self.regexc = re.compile("|".join(parts), flags)
+            self.flags = re.M|re.I
+        self.default = self.compile(self._rules)
+        self.regexc = self.default[0]
         self.ws_regexc = re.compile("\s*", re.MULTILINE)
- 
+
+        compiled = {}
+        self.dispatch = {}
+        for char, candidates in dispatch_table([rule for name, rule, code, callback in self._rules]):
+            if not candidates in compiled:
+                compiled[candidates] = self.compile([self._rules[i] for i in candidates])
+            self.dispatch[char] = compiled[candidates]
+
+    def compile(self, rules):
+        """ Compile the alternation of `rules`. Return the regular expression
+            and the (code, callback) of each rule, indexed by its group number.
+        """
+        parts = ["(?P<%s>%s)" % (name, rule) for name, rule, code, callback in rules]
+        if not parts:
+            parts = ["(?!)"]
+        regexc = re.compile("|".join(parts), self.flags)
+        groups = [None] * (regexc.groups + 1)
+        for name, rule, code, callback in rules:
+            groups[regexc.groupindex[name]] = (code, callback)
+        return regexc, groups
+
     def scan(self, input):
-        """ Return a scanner built for matching through the `input` field. 
-            The scanner that it returns is built well for iterating.
+        """ Return a scanner built for matching through the `input` field,
+            a string or an iterable of strings. The scanner that it returns
+            is built well for iterating.
         """
         return _InputScanner(self, input)
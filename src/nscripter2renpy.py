@@ -1,8 +1,218 @@
-import os, sys
+import functools, io, os, sys, time
 import logging
 from optparse import OptionParser
 
 from parser import Parser, Translator
+from reader import ScriptReader, DecodeError
+from cache import BlockCache
+from writer import Writer, ScriptWriter
+from profiler import Profile
+from assets import AssetIndex
+from optimizer import Optimizer, PASSES
+from tokencache import ParseCache
+import archive, bake, parallel, stringpool
+
+def tokenize(parser, content, options):
+    lex = None
+    if options.lex_jobs is not None:
+        lex = functools.partial(parallel.tokenize, processes=options.lex_jobs or None)
+    if options.parse_cache is not None:
+        ParseCache(options.parse_cache).tokenize(parser, content, lex)
+    elif lex is not None:
+        lex(parser, content)
+    else:
+        parser.tokenize(content)
+
+def convert(script, options, out, cache=None, profile=None):
+    parser = Parser()
+    if options.optimize:
+        out = Optimizer(out, options.optimize)
+
+    if options.replace:
+        errors = 'replace'
+    else:
+        errors = 'strict'
+    reader = ScriptReader(script, encoding=options.encoding, errors=errors)
+    try:
+        if cache is not None:
+            cache.translate(parser, reader.read(), out, options.jobs)
+        elif options.jobs is not None:
+            parallel.translate(parser, reader.read(), out, options.jobs or None)
+        else:
+            if options.stream:
+                parser.scan_skips(reader)
+                parser.tokenize(reader, stream=True)
+            elif profile is not None:
+                with profile.phase('decrypt'):
+                    chunks = list(reader.chunks())
+                with profile.phase('decode'):
+                    content = ''.join(reader.decode(chunks))
+                    del chunks
+                with profile.phase('tokenize'):
+                    tokenize(parser, content, options)
+                profile.tokens = len(parser.tokens)
+            else:
+                content = reader.read()
+                tokenize(parser, content, options)
+
+            translator = Translator(parser, out)
+            if options.predict:
+                translator.predictions = {}
+            if options.extract:
+                # before baking, which reads the extracted images
+                extracted = archive.extract(parser, content, os.path.dirname(script), options.assets or os.path.dirname(script),
+                    encoding=options.encoding)
+                sys.stderr.write('Extracted %d files from the archives\n' % len(extracted))
+            if options.bake is not None:
+                translator.baked = bake.bake(parser, content, options.assets or os.path.dirname(script), options.bake)
+            if options.pool_strings:
+                parser.pool = stringpool.build(parser, translator.baked)
+
+            if profile is not None:
+                translator.profile = profile
+                with profile.phase('translate'):
+                    translator.translate()
+            else:
+                translator.translate()
+    except DecodeError as e:
+        sys.stderr.write('Cannot decode %s: %s\n' % (script, e))
+        return False
+    except archive.ArchiveError as e:
+        sys.stderr.write('Cannot extract the archives: %s\n' % e)
+        return False
+    if parser.pool is not None:
+        sys.stderr.write('Pooled %d strings, saving %d characters\n' % (len(parser.pool.names), parser.pool.saved()))
+    for offset in reader.bad_offsets:
+        sys.stderr.write('Undecodable bytes at offset %d\n' % offset)
+    if options.optimize:
+        out.flush()
+
+    return True
+
+def convert_to(script, options, cache=None, profile=None):
+    """ Convert the script to the output file(s), replacing them only once
+        the conversion succeeded.
+    """
+    output = ScriptWriter(options.output, options.shard_size)
+    success = False
+    try:
+        success = convert(script, options, output, cache, profile)
+    finally:
+        output.close(success)
+
+    return success
+
+def write_manifest(directory, filename):
+    """ Write the manifest of the images of the game `directory`. """
+    index = AssetIndex(directory)
+    with io.open(filename + '.tmp', 'w', encoding='utf-8') as output:
+        index.write_manifest(output)
+    os.rename(filename + '.tmp', filename)
+
+def watch(script, options, cache):
+    """ Convert the script each time it changes, until interrupted. """
+    last = None
+    while True:
+        try:
+            stat = os.stat(script)
+            current = (stat.st_mtime, stat.st_size)
+        except OSError:
+            current = None
+        if current is not None and current != last:
+            last = current
+            start = time.time()
+            hits, misses = cache.hits, cache.misses
+            try:
+                convert_to(script, options, cache)
+            except Exception as e:
+                sys.stderr.write('Conversion failed: %s\n' % e)
+            else:
+                sys.stderr.write('Converted %s in %.2fs (%d blocks cached, %d translated)\n' % (
+                    script, time.time() - start, cache.hits - hits, cache.misses - misses))
+        time.sleep(options.interval)
+
+def option_parser():
+    usage = 'Usage: %prog [options] dirname'
+    optparser = OptionParser(usage)
+    optparser.add_option('-e', '--encoding', dest='encoding', default='cp932',
+            help='script encoding [default: %default]')
+    optparser.add_option('-r', '--replace', dest='replace', action='store_true', default=False,
+            help='replace undecodable bytes instead of aborting')
+    optparser.add_option('-s', '--stream', dest='stream', action='store_true', default=False,
+            help='lex and translate the script as it is read')
+    optparser.add_option('-j', '--jobs', dest='jobs', type='int', default=None,
+            help='translate label blocks in JOBS processes, 0 for one per CPU')
+    optparser.add_option('-L', '--lex-jobs', dest='lex_jobs', type='int', default=None,
+            help='lex shards of the script lines in LEX_JOBS processes, 0 for one per CPU')
+    optparser.add_option('-c', '--cache', dest='cache', default=None,
+            help='keep translated label blocks in the CACHE directory')
+    optparser.add_option('-t', '--parse-cache', dest='parse_cache', default=None,
+            help='keep the lexed script in the PARSE_CACHE directory, by content hash')
+    optparser.add_option('-o', '--output', dest='output', default=None,
+            help='write the script to OUTPUT instead of the standard output')
+    optparser.add_option('--shard-size', dest='shard_size', type='int', default=None,
+            help='split the output at labels into files of about SHARD_SIZE characters (requires --output)')
+    optparser.add_option('-p', '--profile', dest='profile', default=None,
+            help='write the time and memory of each phase, the command counts and the script errors to PROFILE as JSON')
+    optparser.add_option('--no-memory', dest='memory', action='store_false', default=True,
+            help='do not trace the memory when profiling, which slows the conversion down')
+    optparser.add_option('-m', '--manifest', dest='manifest', default=None,
+            help='write the Ren\'Py manifest of the paths and sizes of the images to MANIFEST')
+    optparser.add_option('-a', '--assets', dest='assets', default=None,
+            help='directory of the extracted game files indexed in the manifest [default: dirname]')
+    optparser.add_option('-x', '--extract', dest='extract', action='store_true', default=False,
+            help='extract the files the script uses from the NSA/SAR archives of the game to the assets directory')
+    optparser.add_option('-b', '--bake', dest='bake', default=None, metavar='WIDTHxHEIGHT',
+            help='convert the images to RGBA and scale them to the Ren\'Py screen size in the assets directory')
+    optparser.add_option('-O', '--optimize', dest='optimize', default='',
+            help='comma-separated optimizations of the generated statements, among %s, or all' % ', '.join(PASSES))
+    optparser.add_option('--pool-strings', dest='pool_strings', action='store_true', default=False,
+            help='define the repeated string literals once and reference them by name')
+    optparser.add_option('--predict', dest='predict', action='store_true', default=False,
+            help='predict the images and sounds of each label and menu choice when they are reached')
+    optparser.add_option('-w', '--watch', dest='watch', action='store_true', default=False,
+            help='convert the script again each time it changes (requires --output)')
+    optparser.add_option('--interval', dest='interval', type='float', default=0.5,
+            help='seconds between two checks in watch mode [default: %default]')
+
+    return optparser
+
+def check_options(optparser, options):
+    """ Check the options of a conversion and convert their values. """
+    if options.stream and (options.jobs is not None or options.cache is not None or options.watch):
+        optparser.error('--stream cannot be used with --jobs, --cache or --watch')
+    if options.parse_cache is not None and (options.stream or options.jobs is not None or options.cache is not None):
+        optparser.error('--parse-cache cannot be used with --stream, --jobs or --cache')
+    if options.lex_jobs is not None and (options.stream or options.jobs is not None or options.cache is not None):
+        optparser.error('--lex-jobs cannot be used with --stream, --jobs or --cache')
+    if options.profile is not None and (options.stream or options.jobs is not None or options.cache is not None or options.watch):
+        optparser.error('--profile cannot be used with --stream, --jobs, --cache or --watch')
+    if options.extract and (options.stream or options.jobs is not None or options.cache is not None or options.watch):
+        optparser.error('--extract cannot be used with --stream, --jobs, --cache or --watch')
+    if options.bake is not None:
+        if options.stream or options.jobs is not None or options.cache is not None or options.watch:
+            optparser.error('--bake cannot be used with --stream, --jobs, --cache or --watch')
+        try:
+            options.bake = tuple(int(size) for size in options.bake.lower().split('x'))
+        except ValueError:
+            options.bake = ()
+        if len(options.bake) != 2 or min(options.bake) <= 0:
+            optparser.error('--bake expects a screen size like 800x600')
+    if options.pool_strings and (options.stream or options.jobs is not None or options.cache is not None or options.watch):
+        optparser.error('--pool-strings cannot be used with --stream, --jobs, --cache or --watch')
+    if options.predict and (options.jobs is not None or options.cache is not None or options.watch):
+        optparser.error('--predict cannot be used with --jobs, --cache or --watch')
+    if options.optimize == 'all':
+        options.optimize = PASSES
+    else:
+        options.optimize = [name for name in options.optimize.split(',') if name]
+        for name in options.optimize:
+            if not name in PASSES:
+                optparser.error('unknown optimization: %s' % name)
+    if options.watch and options.output is None:
+        optparser.error('--watch requires --output')
+    if options.shard_size is not None and (options.output is None or options.shard_size <= 0):
+        optparser.error('--shard-size requires --output and a positive size')
 
 if __name__ == '__main__':
     logging.basicConfig(
@@ -15,30 +225,49 @@ if __name__ == '__main__':
 
     logging.debug('Start')
 
-    usage = 'Usage: %prog dirname'
-    optparser = OptionParser(usage)
-
+    optparser = option_parser()
     (options, args) = optparser.parse_args()
 
     if len(args) == 0:
         optparser.print_usage()
         sys.exit(-1)
 
+    check_options(optparser, options)
+
     dirname = args[0]
     if dirname is None:
         dirname = os.getcwd()
 
-    parser = Parser()
-
     script = os.path.join(dirname, 'nscript.dat')
-    input = open(script, 'rb')
-    content = parser.read_script(input)
-    input.close()
-    content = content.decode('sjis')
 
-    parser.tokenize(content)
+    cache = None
+    if options.cache is not None or options.watch:
+        cache = BlockCache(options.cache)
 
-    translator = Translator(parser, sys.stdout)
+    profile = None
+    if options.profile is not None:
+        profile = Profile(script, options.memory)
+        profile.start()
 
-    translator.translate()
+    if options.watch:
+        if options.manifest is not None:
+            write_manifest(options.assets or dirname, options.manifest)
+        try:
+            watch(script, options, cache)
+        except KeyboardInterrupt:
+            pass
+    elif options.output is not None:
+        success = convert_to(script, options, cache, profile)
+    else:
+        output = Writer(sys.stdout)
+        success = convert(script, options, output, cache, profile)
+        output.flush()
 
+    if profile is not None:
+        profile.stop()
+        profile.write(options.profile)
+    # after the conversion, which adds the baked images
+    if options.manifest is not None and not options.watch:
+        write_manifest(options.assets or dirname, options.manifest)
+    if not options.watch and not success:
+        sys.exit(-1)
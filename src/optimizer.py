@@ -0,0 +1,115 @@
+import re
+
+# the optimizations, in the order they are applied
+PASSES = ('scenes', 'pauses', 'sprites', 'python')
+
+PAUSE = re.compile(r"renpy\.pause\(([0-9]+)/1000\.0\)$")
+SCENE = 'renpy.scene()'
+# background colors: showing an image sets the scale of the images from its
+# size the first time, so only colors can be dropped
+SHOW_COLOR = re.compile(r'show_image\(ns_state, "#[a-fA-F0-9]{6}", "bg"\)$')
+# statements that interact with the player or leave the script: a python
+# block is restarted from its beginning when such a statement is loaded or
+# rolled back to, so they are never merged
+BARRIER = re.compile(r"renpy\.(pause|full_restart)\(")
+# runtime calls changing a sprite, by the name of their operation in a batch
+SPRITE = re.compile(r"(store_show_sprite|move_sprite|toggle_sprite|clear_sprite)\(ns_state, (.*)\)$")
+SPRITE_OPERATIONS = {'store_show_sprite': 'lsp', 'move_sprite': 'msp', 'toggle_sprite': 'vsp', 'clear_sprite': 'csp'}
+
+class Optimizer(object):
+    """ Rewrites the statements written by the Translator before passing
+        them to `out`:
+          - scenes: drops the scene resets and background colors that are
+            reset again before anything is displayed,
+          - pauses: folds consecutive constant pauses into one,
+          - sprites: batches consecutive sprite changes into one
+            update_sprites call, which shows each sprite once,
+          - python: merges consecutive python one-liners into python blocks.
+        Only consecutive statements of the same block are rewritten, so
+        nothing is displayed between them.
+    """
+
+    def __init__(self, out, passes=PASSES):
+        self.out = out
+        self.passes = frozenset(passes)
+        self.pending = ''
+        # python statements not written yet, of the same indentation
+        self.run = []
+        self.indent = ''
+        # sprite statements not batched yet, with their operation
+        self.sprites = []
+
+    def write(self, text):
+        lines = (self.pending + text).split('\n')
+        self.pending = lines.pop()
+        for line in lines:
+            self.write_line(line)
+
+    def write_line(self, line):
+        body = line.lstrip(' ')
+        indent = line[:len(line) - len(body)]
+        if not body.startswith('$ '):
+            self.flush_run()
+            self.out.write(line + '\n')
+            return
+        if indent != self.indent:
+            self.flush_run()
+            self.indent = indent
+        self.add(body[2:])
+
+    def add(self, statement):
+        if 'sprites' in self.passes:
+            sprite = SPRITE.match(statement)
+            if sprite is not None:
+                self.sprites.append((statement, "('%s', %s)" % (SPRITE_OPERATIONS[sprite.group(1)], sprite.group(2))))
+                return
+            self.flush_sprites()
+        run = self.run
+        if 'scenes' in self.passes and statement == SCENE:
+            while run and SHOW_COLOR.match(run[-1]):
+                run.pop()
+            if run and run[-1] == SCENE:
+                run.pop()
+        if 'pauses' in self.passes and run:
+            pause = PAUSE.match(statement)
+            previous = PAUSE.match(run[-1])
+            if pause is not None and previous is not None:
+                run[-1] = 'renpy.pause(%d/1000.0)' % (int(previous.group(1)) + int(pause.group(1)))
+                return
+        run.append(statement)
+
+    def flush_sprites(self):
+        if len(self.sprites) == 1:
+            self.run.append(self.sprites[0][0])
+        elif self.sprites:
+            self.run.append('update_sprites(ns_state, [%s])' % ', '.join(operation for statement, operation in self.sprites))
+        self.sprites = []
+
+    def flush_run(self):
+        self.flush_sprites()
+        block = []
+        for statement in self.run:
+            if BARRIER.match(statement):
+                self.write_block(block)
+                block = []
+                self.out.write('%s$ %s\n' % (self.indent, statement))
+            else:
+                block.append(statement)
+        self.write_block(block)
+        self.run = []
+
+    def write_block(self, block):
+        if len(block) > 1 and 'python' in self.passes:
+            self.out.write('%spython:\n' % self.indent)
+            for statement in block:
+                self.out.write('%s  %s\n' % (self.indent, statement))
+        else:
+            for statement in block:
+                self.out.write('%s$ %s\n' % (self.indent, statement))
+
+    def flush(self):
+        """ Write the pending statements. The output is not flushed. """
+        self.flush_run()
+        if self.pending:
+            self.out.write(self.pending)
+            self.pending = ''
@@ -0,0 +1,208 @@
+import bisect, gc, multiprocessing
+from io import StringIO
+
+from lexer import Lexer, UnknownTokenError
+from parser import Parser, Translator
+import tokencache
+
+# minimum number of lines translated by a worker at once
+TASK_LINES = 2000
+# minimum number of characters lexed by a worker at once
+SHARD_SIZE = 1 << 18
+# shards lexed by each process, so that the last ones do not wait for a
+# slower one
+SHARDS_PER_PROCESS = 4
+
+def split_blocks(parser, lines):
+    """ Return the first line of each label block of the script. A label
+        starts a block when it begins its line and the previous line does
+        not end with a comma, in which case it is a command argument.
+    """
+    lex = Lexer(parser.rules, case_sensitive=False)
+    starts = [1]
+    previous = None
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith(';'):
+            continue
+        if line.startswith('*') and previous is not None and lineno > starts[-1]:
+            try:
+                tokens = [token for token in lex.scan(previous) if token.type != "COMMENT"]
+            except UnknownTokenError:
+                tokens = None
+            if tokens and tokens[-1].type != "COMMA":
+                starts.append(lineno)
+        previous = line
+
+    return starts
+
+def scan_aliases(parser, content):
+    """ Return the (line, aliases, alias, value) definitions of the script,
+        aliases being the name of the Parser table they go to.
+    """
+    definitions = []
+    tokens = list(parser.scan_lines(content, 'alias'))
+    for i in range(len(tokens) - 3):
+        command, alias, comma, val = tokens[i:i + 4]
+        if command.type != "IDENTIFIER" or alias.type != "IDENTIFIER" or comma.type != "COMMA" or val.line != command.line:
+            continue
+        if command.value == 'numalias' and val.type == "NUM":
+            definitions.append((command.line, 'numaliases', alias.value, val.value))
+        elif command.value == 'stralias' and val.type == "STR":
+            definitions.append((command.line, 'straliases', alias.value, parser.escape(val)))
+
+    return definitions
+
+def tasks(parser, content, task_lines=TASK_LINES):
+    """ Split the script into tasks of consecutive label blocks, each with
+        the aliases defined before it and the skip labels it uses. A task
+        writes the skip labels up to the first line of the next one, as
+        they come before the label starting it.
+    """
+    skips = []
+    for token in parser.scan_lines(content, 'skip'):
+        if token.type == "SKIP":
+            skips.append((token.line, token.line + token.value))
+    targets = sorted(parser.skiplabel)
+
+    definitions = scan_aliases(parser, content)
+    defined = 0
+    aliases = {'numaliases': {}, 'straliases': {}}
+
+    lines = content.split('\n')
+    starts = split_blocks(parser, lines)
+    starts.append(len(lines) + 1)
+
+    first = 1
+    first_target = 0
+    for i in range(1, len(starts)):
+        end = starts[i]
+        if end - first < task_lines and i < len(starts) - 1:
+            continue
+
+        while defined < len(definitions) and definitions[defined][0] < first:
+            line, table, alias, val = definitions[defined]
+            aliases[table][alias] = val
+            defined += 1
+
+        flush = i < len(starts) - 1
+        if flush:
+            last_target = bisect.bisect_right(targets, end)
+        else:
+            last_target = len(targets)
+        emitted = targets[first_target:last_target]
+        skiplabel = {}
+        for skipto in emitted:
+            skiplabel[skipto] = parser.skiplabel[skipto]
+        for line, skipto in skips[bisect.bisect_left(skips, (first,)):bisect.bisect_left(skips, (end,))]:
+            skiplabel[skipto] = parser.skiplabel[skipto]
+
+        text = '\n'.join(lines[first - 1:end - 1])
+        yield (text, first, dict(aliases['numaliases']), dict(aliases['straliases']), skiplabel, emitted, flush)
+
+        first = end
+        first_target = last_target
+
+def split_lines(content, count):
+    """ Split `content` on line boundaries into at most `count` shards of
+        about the same size. Return the (text, first line) of each shard.
+    """
+    size = max(len(content) // count, 1)
+    shards = []
+    start = 0
+    lineno = 1
+    while start < len(content):
+        end = content.find('\n', start + size)
+        if end < 0:
+            end = len(content)
+        else:
+            end += 1
+        shards.append((content[start:end], lineno))
+        lineno += content.count('\n', start, end)
+        start = end
+
+    return shards
+
+def tokenize_shard(shard):
+    """ Lex a shard in a worker process and return its tokens serialized,
+        which is much faster to send back than pickled tokens. Compressing
+        them would only slow the workers down.
+    """
+    text, lineno = shard
+    parser = Parser()
+    parser.tokenize(text, lineno=lineno)
+    return tokencache.dumps(parser.tokens, 0)
+
+def tokenize(parser, content, processes=None):
+    """ Tokenize the script `content` like Parser.tokenize, lexing shards
+        of its lines in a pool of processes. Tokens never span lines and the
+        skip targets only depend on line numbers, so the shards are lexed
+        independently and their skip labels registered in order once merged.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    count = min(processes * SHARDS_PER_PROCESS, len(content) // SHARD_SIZE)
+    if processes <= 1 or count <= 1:
+        parser.tokenize(content)
+        return
+
+    tokens = []
+    pool = multiprocessing.Pool(processes)
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for data in pool.imap(tokenize_shard, split_lines(content, count)):
+            tokens.extend(tokencache.loads(data))
+    finally:
+        if enabled:
+            gc.enable()
+        pool.terminate()
+        pool.join()
+    parser.use_tokens(tokens)
+
+def translate_task(task):
+    """ Translate a task in a worker process and return the output, the
+        sizes of the state tables it uses and its effect definitions.
+    """
+    text, lineno, numaliases, straliases, skiplabel, skips, flush = task
+    parser = Parser()
+    parser.numaliases = numaliases
+    parser.straliases = straliases
+    parser.skiplabel = skiplabel
+    parser.tokenize(text, lineno=lineno)
+
+    out = StringIO()
+    translator = Translator(parser, out)
+    translator.indent = 1
+    translator.skips = sorted(skips, reverse=True)
+    translator.nskips = len(skiplabel)
+    translator.translate_tokens()
+    if flush:
+        translator.write_skip_labels()
+
+    return out.getvalue(), parser.sizes, translator.effects
+
+def translate_tasks(tasks, processes=None):
+    """ Yield the result of each task in order, translating them in a pool
+        of processes.
+    """
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap(translate_task, tasks):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+def translate(parser, content, out, processes=None):
+    """ Translate the script `content` like Translator.translate, splitting
+        it at labels and translating the blocks in a pool of processes.
+    """
+    translator = Translator(parser, out)
+    translator.write_header()
+
+    for output, sizes, effects in translate_tasks(tasks(parser, content), processes):
+        out.write(output)
+        parser.merge_sizes(sizes)
+        translator.effects.update(effects)
+    translator.write_footer()
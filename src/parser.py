@@ -1,20 +1,94 @@
-import os, sys
+import functools, gc, io, os, re, sys, time
+from collections import deque
 
 import Image
 
-from lexer import Lexer, Token
+from lexer import Lexer, Token, type_code, type_mask, mask_types
+from reader import DECRYPT_TABLE
 
 class SyntaxError(Exception):
     pass
 
+def lines(content):
+    """ Iterate over the lines of `content`, a string or an iterable of
+        strings. Like the lexer, only \\n is treated as a line break.
+    """
+    if isinstance(content, str):
+        for line in io.StringIO(content, newline='\n'):
+            yield line
+        return
+
+    pending = ''
+    for chunk in content:
+        parts = (pending + chunk).split('\n')
+        pending = parts.pop()
+        for line in parts:
+            yield line + '\n'
+    if pending:
+        yield pending
+
+# number of distinct texts whose translation is remembered: lines and menu
+# choices repeat a lot in visual novels
+TEXT_CACHE_SIZE = 4096
+# characters of the texts of menu choices and of dialogue lines, translated
+# by str.translate in a single pass
+CHOICE_TABLE = str.maketrans({'`': None, '"': '\\"'})
+DIALOGUE_TABLE = str.maketrans({'`': None, '"': '\\"', '@': '{w}', '\\': '{w}'})
+
+def escape_spaces(text):
+    """ Escape the leading spaces of `text`, which Ren'Py would strip. """
+    stripped = text.lstrip(' ')
+    if len(stripped) == len(text):
+        return text
+    return '\\ ' * (len(text) - len(stripped)) + stripped
+
+@functools.lru_cache(maxsize=TEXT_CACHE_SIZE)
+def escape_choice(text):
+    """ Return the Ren'Py string of the text of a menu choice, without its
+        quotes.
+    """
+    return escape_spaces(text.translate(CHOICE_TABLE))
+
+@functools.lru_cache(maxsize=TEXT_CACHE_SIZE)
+def escape_dialogue(text):
+    """ Return the Ren'Py string of a dialogue line, without its quotes:
+        the @ and \\ waits become {w}, and the line does not wait at its end
+        unless it ends with one.
+    """
+    text = escape_spaces(text.translate(DIALOGUE_TABLE))
+    if text.endswith('{w}'):
+        return text[:-3]
+    return text + '{nw}'
+
+def unique(items):
+    """ Return the items of the list `items` without duplicates, in order. """
+    seen = set()
+    return [item for item in items if not (item in seen or seen.add(item))]
+
+COMMENT = type_code("COMMENT")
+COLOR = type_code("COLOR")
+IDENTIFIER = type_code("IDENTIFIER")
+NUMALIAS = type_code("NUMALIAS")
+STRALIAS = type_code("STRALIAS")
+SKIP = type_code("SKIP")
+
 class Parser(object):
     def __init__(self):
         self.tokens = None
+        self.stream = None
+        self.lookahead = deque()
         self.current = 0
         self.skiplabel = {}
         self.nskip = 0
         self.numaliases = {}
         self.straliases = {}
+        # number of entries of the runtime tables the script uses, None
+        # when an index is only known at runtime
+        self.sizes = {'numvars': 0, 'strvars': 0, 'sprites': 0}
+        self.masks = {}
+        # a stringpool.StringPool of the string literals referenced by name
+        self.pool = None
+        self.escaper = self.escape
 
         self.rules = [
             ("BLANK", r"[ \t\r\n]+"),
@@ -43,34 +117,86 @@ class Parser(object):
  
     def skip_cb(self, scanner, token, line):
         skip = int(token.replace('skip', ''))
+        self.add_skip(line, skip)
+
+        return skip
+
+    def add_skip(self, line, skip):
         skipto = line + skip
         if not skipto in self.skiplabel:
             self.skiplabel[skipto] = "__skip__%i" % self.nskip
             self.nskip += 1
 
-        return skip
-
-    def tokenize(self, content):
+    def tokenize(self, content, stream=False, lineno=1):
+        """ Tokenize `content`, a string or an iterable of strings starting
+            at line `lineno`. With `stream`, tokens are only lexed when read,
+            so `scan_skips` must have been called first for backward skips
+            to resolve.
+        """
         lex = Lexer(self.rules, case_sensitive=False)
-        self.tokens = [token for token in lex.scan(content) if token is not None and token.type != "COMMENT"]
+        scanner = lex.scan(content)
+        scanner.lineno = lineno
+        tokens = (token for token in scanner if token is not None and token.code != COMMENT)
+        if stream:
+            self.tokens = None
+            self.stream = tokens
+        else:
+            # tokens cannot form reference cycles, so collecting while the
+            # list grows is wasted time
+            enabled = gc.isenabled()
+            gc.disable()
+            try:
+                self.tokens = list(tokens)
+            finally:
+                if enabled:
+                    gc.enable()
+            self.stream = None
+        self.lookahead.clear()
 
         self.current = 0
 
+    def use_tokens(self, tokens):
+        """ Use tokens lexed beforehand, registering their skip targets like
+            the lexer does.
+        """
+        for token in tokens:
+            if token.code == SKIP:
+                self.add_skip(token.line, token.value)
+        self.tokens = tokens
+        self.stream = None
+        self.lookahead.clear()
+
+        self.current = 0
+
+    def scan_skips(self, content):
+        """ Fill the skip labels table without keeping any token. """
+        for token in self.scan_lines(content, 'skip'):
+            pass
+
+    def scan_lines(self, content, keyword):
+        """ Yield the tokens of the lines of `content` mentioning `keyword`.
+            Tokens never span lines, so they are the same as when lexing the
+            whole content.
+        """
+        lex = Lexer(self.rules, case_sensitive=False)
+        for lineno, line in enumerate(lines(content), 1):
+            if keyword in line.lower():
+                scanner = lex.scan(line)
+                scanner.lineno = lineno
+                for token in scanner:
+                    yield token
+
     def read_script(self, file, encrypted = True):
         content = file.read()
-        result = ''
         if encrypted:
-            for c in content:
-                val = ord(c)
-                val ^= 0x84
-                result += chr(val)
-        else:
-            result = content
+            content = content.translate(DECRYPT_TABLE)
 
-        return result
+        return content
 
     def escape(self, token):
         if token.type == "STR":
+            if self.pool is not None:
+                return self.pool.reference(token.value.replace('\\', '/'))
             return token.value.replace('\\', '/')
         elif token.type == "IDENTIFIER":
             return token.value
@@ -84,6 +210,7 @@ class Parser(object):
                 val = self.numaliases[var]
             else:
                 val = var
+            self.use_index('numvars', val)
             return 'ns_state.numvars[%s]' % val
         elif token.type == "VARSTR":
             var = token.value.replace('$', '')
@@ -91,6 +218,7 @@ class Parser(object):
                 val = self.numaliases[var]
             else:
                 val = var
+            self.use_index('strvars', val)
             return 'ns_state.strvars[%s]' % val
         elif token.type == "COLOR":
             return '"%s"' % token.value
@@ -101,40 +229,160 @@ class Parser(object):
         else:
             return token.value
 
+    def use_index(self, table, index):
+        """ Grow the size of the runtime `table` so that it holds `index`,
+            the escaped index found in the script.
+        """
+        size = self.sizes[table]
+        if size is None:
+            return
+        try:
+            index = int(index)
+        except ValueError:
+            self.sizes[table] = None
+            return
+        if index >= size:
+            self.sizes[table] = index + 1
+
+    def merge_sizes(self, sizes):
+        """ Grow the table sizes to those of another part of the script. """
+        for table, size in sizes.items():
+            if size is None or self.sizes[table] is None:
+                self.sizes[table] = None
+            else:
+                self.sizes[table] = max(size, self.sizes[table])
+
     def peek(self):
-        return self.tokens[self.current]
+        if self.stream is None:
+            return self.tokens[self.current]
 
-    def read(self, expectedType=None, mandatory=True):
-        if self.current >= len(self.tokens):
-            return None
+        if not self.lookahead:
+            self.lookahead.append(next(self.stream))
+        return self.lookahead[0]
 
-        token = self.tokens[self.current]
-        if token.type == 'IDENTIFIER':
+    def read(self, expectedType=None, mandatory=True):
+        if self.stream is None:
+            if self.current >= len(self.tokens):
+                return None
+            token = self.tokens[self.current]
+        else:
+            if not self.lookahead:
+                token = next(self.stream, None)
+                if token is None:
+                    return None
+                self.lookahead.append(token)
+            token = self.lookahead[0]
+        if token.code == IDENTIFIER:
             if token.value in self.numaliases:
-                token.type = 'NUMALIAS'
+                token.code = NUMALIAS
             elif token.value in self.straliases:
-                token.type = 'STRALIAS'
+                token.code = STRALIAS
+
+        if expectedType is not None and not isinstance(expectedType, int):
+            expectedType = self.mask(expectedType)
 
-        if expectedType is None or (type(expectedType).__name__=='list' and token.type in expectedType) or token.type == expectedType:
+        if expectedType is None or (1 << token.code) & expectedType:
             self.current += 1
-            token.escaped = self.escape(token)
+            if self.stream is not None:
+                self.lookahead.popleft()
+            token.escaper = self.escaper
             return token
         else:
             if mandatory:
-                raise SyntaxError("Expected %s on %i got %s (%s)" % (expectedType, token.line, token.type, token.value))
+                raise SyntaxError("Expected %s on %i got %s (%s)" % (mask_types(expectedType), token.line, token.type, token.value))
             else:
                 return None
 
+    def mask(self, types):
+        """ Return the bitmask of a type name or a list of type names. """
+        if isinstance(types, str):
+            mask = self.masks.get(types)
+            if mask is None:
+                mask = self.masks[types] = type_mask(types)
+            return mask
+        return type_mask(types)
+
+# argument classes usable in command signatures
+ARGUMENTS = {
+    'NUMBER': ["NUM", "VARNUM", "NUMALIAS"],
+    'STRING': ["STR", "VARSTR", "STRALIAS"],
+}
+
+CONDITION = type_mask(["NUM", "VARNUM", "NUMALIAS", "LT", "LE", "GT", "GE", "EQ", "NEQ", "AND", "OR"])
+
+INDENTS = ['  ' * i for i in range(8)]
+# images predicted when entering a label, its own first and then those of
+# the labels it jumps to or calls
+PREDICT_IMAGES = 16
+PREDICT_SOUNDS = 8
+
+# command name -> (handler, compiled signature)
+commands = {}
+
+def compile_signature(signature):
+    """ Compile a signature such as 'NUM,STRING|TEXT[,NUMBER[,STR]]' into a
+        list of expected token type masks. Each optional group becomes a
+        nested tuple that is only read if it starts with a comma.
+    """
+    stack = [[]]
+    for part in re.findall(r"\[,|\]|[^,\[\]]+", signature):
+        if part == '[,':
+            stack.append([])
+        elif part == ']':
+            group = tuple(stack.pop())
+            stack[-1].append(group)
+        else:
+            types = []
+            for name in part.split('|'):
+                types.extend(ARGUMENTS.get(name, [name]))
+            stack[-1].append(type_mask(types))
+
+    return stack[0]
+
+def register_command(name, handler, signature=None):
+    """ Register `handler(translator, *args)` for the command `name`. Its
+        arguments are read according to `signature`, or by the handler
+        itself if the signature is None.
+    """
+    if signature is not None:
+        signature = compile_signature(signature)
+    commands[name] = (handler, signature)
+
+def command(name, signature=None):
+    """ Decorator registering a Translator method as a command handler. """
+    def register(handler):
+        register_command(name, handler, signature)
+        return handler
+    return register
+
 class Translator(object):
     def __init__(self, parser, out):
         self.parser = parser
         self.out = out
         self.indent = 0
         self.skipline = 0
+        # skip targets not emitted yet, sorted by decreasing line
+        self.skips = []
+        self.skipdone = {}
+        self.nskips = 0
+        # a profiler.Profile counting the commands, if profiling
+        self.profile = None
+        # escaped image path -> escaped path of its baked image
+        self.baked = None
+        # label -> ([images], [sounds], [labels jumped to or called]) used
+        # in the label block, in order, if predicting
+        self.predictions = None
+        self.label = 'start'
+        # effect number -> (type, duration, mask) of the effect definitions
+        self.effects = {}
 
     def translate(self):
-        skipdone = {}
+        self.write_header()
+        self.translate_tokens()
+        self.indent = 0
+        self.write_footer()
 
+    def write_header(self):
         self.write_statement('label after_load:')
         self.indent += 1
         self.write_statement('$ init_vars(False)')
@@ -144,20 +392,108 @@ class Translator(object):
         self.write_statement('label start:')
         self.indent += 1
         self.write_statement('$ init_vars(True)')
+
+    def write_footer(self):
+        """ Write the size of the state tables, known once the whole script
+            is translated. Init blocks run before the game wherever they are.
+        """
+        self.indent = 0
+        self.write_statement('\ninit -1 python:')
+        sizes = self.parser.sizes
+        self.write_statement('    ns_state_size = {%s}' % ', '.join("'%s': %s" % (table, sizes[table]) for table in sorted(sizes)))
+        if self.predictions is not None:
+            self.write_predictions()
+        if self.parser.pool is not None:
+            for literal, name in self.parser.pool.names.items():
+                self.write_statement('    %s = %s' % (name, literal))
+        if self.effects:
+            # after the pool, whose names the masks may be
+            self.write_effects()
+
+    def write_predictions(self):
+        """ Write the images and sounds the runtime predicts when entering
+            each label: those of its block, then those of the labels it
+            jumps to or calls, so that they load while the block plays.
+        """
+        self.write_statement('    ns_predict = {')
+        for label in sorted(self.predictions):
+            images, sounds, targets = self.predictions[label]
+            images, sounds = list(images), list(sounds)
+            for target in targets:
+                if target in self.predictions:
+                    images.extend(self.predictions[target][0])
+                    sounds.extend(self.predictions[target][1])
+            images = unique(images)[:PREDICT_IMAGES]
+            sounds = unique(sounds)[:PREDICT_SOUNDS]
+            if images or sounds:
+                self.write_statement("        '%s': ((%s), (%s))," % (label,
+                    ''.join('%s, ' % image for image in images), ''.join('%s, ' % sound for sound in sounds)))
+        self.write_statement('    }')
+
+    def write_effects(self):
+        """ Write the transitions of the effect definitions, built once by
+            the runtime after it is initialized.
+        """
+        self.write_statement('\ninit 2 python:')
+        self.write_statement('    ns_effects = {')
+        for number in sorted(self.effects):
+            self.write_statement('        %d: ns_transition(%d, %d, %s),' % ((number,) + self.effects[number]))
+        self.write_statement('    }')
+
+    def write_effect(self, effect):
+        """ Write the transition of the effect number `effect` of a command.
+            Effects 0 and 1 display at once.
+        """
+        if effect is None or effect.escaped in ('0', '1'):
+            return
+        self.write_statement('with ns_effects.get(%s)' % effect.escaped)
+
+    def use_asset(self, kind, expression):
+        """ Record an image (kind 0) or sound (kind 1) used by the current
+            label, if it is a literal known before running the script.
+        """
+        if self.predictions is None:
+            return
+        if self.parser.pool is not None:
+            expression = self.parser.pool.literal(expression)
+        # images given as "#rrggbb" are colours
+        if expression.startswith('"') and not (kind == 0 and expression.startswith('"#')):
+            self.label_predictions()[kind].append(expression)
+
+    def use_label(self, label):
+        """ Record a label the current label jumps to or calls. """
+        if self.predictions is not None:
+            self.label_predictions()[2].append(label)
+
+    def label_predictions(self):
+        predictions = self.predictions.get(self.label)
+        if predictions is None:
+            self.predictions[self.label] = predictions = ([], [], [])
+        return predictions
+
+    def translate_tokens(self):
         while True:
             token = self.parser.read()
             if token is None:
                 break
 
-            for skipto in self.parser.skiplabel.keys():
-                if not skipto in skipdone and skipto <= token.line:
-                    self.write_statement('\nlabel %s:' % self.parser.skiplabel[skipto])
-                    skipdone[skipto] = True
-                    break
+            if len(self.parser.skiplabel) != self.nskips:
+                # new targets found while streaming
+                self.nskips = len(self.parser.skiplabel)
+                self.skips = sorted([skipto for skipto in self.parser.skiplabel if not skipto in self.skipdone], reverse=True)
 
+            self.write_skip_labels(token.line)
             self.handle_token(token)
 
-        self.indent = 0
+    def write_skip_labels(self, line=None):
+        """ Write the labels of the pending skip targets up to `line`, or
+            all of them.
+        """
+        skips = self.skips
+        while skips and (line is None or skips[-1] <= line):
+            skipto = skips.pop()
+            self.write_statement('\nlabel %s:' % self.parser.skiplabel[skipto])
+            self.skipdone[skipto] = True
 
     def handle_token(self, token):
         if token.line == self.skipline:
@@ -167,7 +503,8 @@ class Translator(object):
             self.read_command(token)
         elif token.type == "LABEL":
             self.indent = 0
-            self.write_statement('\nlabel %s:' % token.value.replace('*', ''))
+            self.label = token.value.replace('*', '')
+            self.write_statement('\nlabel %s:' % self.label)
             self.indent = 1
         elif token.type == "TEXT":
             self.read_text(token)
@@ -180,271 +517,137 @@ class Translator(object):
         elif token.type == "PLUS":
             pass
         else:
+            if self.profile is not None:
+                self.profile.add_invalid_token(token)
             sys.stderr.write('Invalid token: %s (%s) at %d\n' % (token.type, token.value, token.line))
             self.skipline = token.line
 
     def write_statement(self, line, newline=True):
-        for i in range(self.indent):
-            self.out.write('  ')
-        self.out.write(line)
+        if self.indent < len(INDENTS):
+            indent = INDENTS[self.indent]
+        else:
+            indent = '  ' * self.indent
         if newline:
-            self.out.write('\n')
+            self.out.write(indent + line + '\n')
+        else:
+            self.out.write(indent + line)
 
     def read_text(self, token):
-        term = ''
-        text = token.value.replace('`', '')
-
-        text = text + '{nw}'
-        text = text.replace('@', '{w}')
-        text = text.replace('\\', '{w}')
-        text = text.replace('{w}{nw}', '')
-        text = self.escape_text(text)
-        self.write_statement('"%s"' % text)
+        self.write_statement('"%s"' % escape_dialogue(token.value))
         if '\\' in token.value:
             self.write_statement('nvl clear')
 
-    def escape_text(self, text):
-        escaped = ''
-        leading = True
-        for c in text:
-            if c == ' ' and leading:
-                escaped += '\ '
-            else:
-                escaped += c
-                leading = False
-
-        return escaped.replace('"', '\\"')
+    def image(self, token):
+        """ Return the escaped image path of `token`, pointing at its baked
+            image if there is one.
+        """
+        if self.baked is None:
+            path = token.escaped
+        elif self.parser.pool is not None:
+            pool = self.parser.pool
+            path = pool.literal(token.escaped)
+            path = pool.reference(self.baked.get(path, path))
+        else:
+            path = self.baked.get(token.escaped, token.escaped)
+        # colours are not files to predict
+        if token.code != COLOR:
+            self.use_asset(0, path)
+        return path
 
     def read_skip(self, token):
         skipto = token.line + token.value
         self.write_statement('jump %s' % self.parser.skiplabel[skipto])
 
     def read_command(self, token):
-        if token.value == 'add':
-            self.cmd_add()
-        elif token.value == 'autoclick':
-            self.cmd_autoclick()
-        elif token.value == 'bg':
-            self.cmd_bg()
-        elif token.value == 'br':
-            self.cmd_br()
-        elif token.value == 'btn':
-            self.cmd_btn()
-        elif token.value == 'btndef':
-            self.cmd_btndef()
-        elif token.value == 'btnwait':
-            self.cmd_btnwait()
-        elif token.value == 'caption':
-            self.cmd_caption()
-        elif token.value == 'cl':
-            self.cmd_cl()
-        elif token.value == 'click':
-            self.cmd_click()
-        elif token.value == 'clickstr':
-            self.cmd_clickstr()
-        elif token.value == 'cmp':
-            self.cmd_cmp()
-        elif token.value == 'csp':
-            self.cmd_csp()
-        elif token.value == '!d':
-            self.cmd_d()
-        elif token.value == 'date':
-            self.cmd_date()
-        elif token.value == 'dec':
-            self.cmd_dec()
-        elif token.value == 'delay':
-            self.cmd_delay()
-        elif token.value == 'effect':
-            self.cmd_effect()
-        elif token.value == 'effectblank':
-            self.cmd_effectblank()
-        elif token.value == 'end':
-            self.cmd_end()
-        elif token.value == 'filelog':
-            self.cmd_filelog()
-        elif token.value == 'game':
-            self.cmd_game()
-        elif token.value == 'globalon':
-            self.cmd_globalon()
-        elif token.value == 'goto':
-            self.cmd_goto()
-        elif token.value == 'gosub':
-            self.cmd_gosub()
-        elif token.value == 'if':
-            self.cmd_if()
-        elif token.value == 'inc':
-            self.cmd_inc()
-        elif token.value == 'ld':
-            self.cmd_ld()
-        elif token.value == 'lookbackbutton':
-            self.cmd_lookbackbutton()
-        elif token.value == 'lookbackcolor':
-            self.cmd_lookbackcolor()
-        elif token.value == 'lsp':
-            self.cmd_lsp()
-        elif token.value == 'menuselectcolor':
-            self.cmd_menuselectcolor()
-        elif token.value == 'menusetwindow':
-            self.cmd_menusetwindow()
-        elif token.value == 'monocro':
-            self.cmd_monocro()
-        elif token.value == 'mov':
-            self.cmd_mov()
-        elif token.value == 'msp':
-            self.cmd_msp()
-        elif token.value == 'notif':
-            self.cmd_notif()
-        elif token.value == 'nsa':
-            self.cmd_nsa()
-        elif token.value == 'nsadir':
-            self.cmd_nsadir()
-        elif token.value == 'numalias':
-            self.cmd_numalias()
-        elif token.value == 'play':
-            self.cmd_play()
-        elif token.value == 'playstop':
-            self.cmd_playstop()
-        elif token.value == 'print':
-            self.cmd_print()
-        elif token.value == 'quakex':
-            self.cmd_quakex()
-        elif token.value == 'quakey':
-            self.cmd_quakey()
-        elif token.value == 'repaint':
-            self.cmd_repaint()
-        elif token.value == 'resettimer':
-            self.cmd_resettimer()
-        elif token.value == 'return':
-            self.cmd_return()
-        elif token.value == 'rmenu':
-            self.cmd_rmenu()
-        elif token.value == '!s':
-            self.cmd_s()
-        elif token.value == 'savename':
-            self.cmd_savename()
-        elif token.value == 'savenumber':
-            self.cmd_savenumber()
-        elif token.value == '!sd':
-            self.cmd_sd()
-        elif token.value == 'select':
-            self.cmd_select()
-        elif token.value == 'selectcolor':
-            self.cmd_selectcolor()
-        elif token.value == 'selgosub':
-            self.cmd_selgosub()
-        elif token.value == 'setcursor':
-            self.cmd_setcursor()
-        elif token.value == 'setwindow':
-            self.cmd_setwindow()
-        elif token.value == 'stop':
-            self.cmd_stop()
-        elif token.value == 'stralias':
-            self.cmd_stralias()
-        elif token.value == 'sub':
-            self.cmd_sub()
-        elif token.value == 'systemcall':
-            self.cmd_systemcall()
-        elif token.value == 'textclear':
-            self.cmd_textclear()
-        elif token.value == 'textoff':
-            self.cmd_textoff()
-        elif token.value == 'texton':
-            self.cmd_texton()
-        elif token.value == 'trap':
-            self.cmd_trap()
-        elif token.value == 'versionstr':
-            self.cmd_versionstr()
-        elif token.value == 'vsp':
-            self.cmd_vsp()
-        elif token.value == '!w':
-            self.cmd_w()
-        elif token.value == 'wait':
-            self.cmd_wait()
-        elif token.value == 'waittimer':
-            self.cmd_waittimer()
-        elif token.value == 'wave':
-            self.cmd_wave()
-        elif token.value == 'waveloop':
-            self.cmd_waveloop()
-        elif token.value == 'wavestop':
-            self.cmd_wavestop()
-        elif token.value == 'windoweffect':
-            self.cmd_windoweffect()
-        else:
+        command = commands.get(token.value)
+        if command is None:
+            if self.profile is not None:
+                self.profile.add_unknown_command(token)
             sys.stderr.write('Unknown command: %s\n' % token.value)
+            return
 
-    def cmd_add(self):
-        # VARNUM, NUM
-        # VARSTR, STR
-        var = self.parser.read(["VARNUM", "VARSTR"])
-        self.parser.read("COMMA")
-
-        if var.type == "VARNUM":
-            val = self.parser.read(["NUM", "VARNUM", "NUMALIAS"])
+        handler, signature = command
+        if self.profile is not None:
+            # the time of a command includes the commands it runs, like if
+            start = time.perf_counter()
+        if signature is None:
+            handler(self)
         else:
-            val = self.parser.read(["STR", "VARSTR", "STRALIAS"])
+            handler(self, *self.read_arguments(signature))
+        if self.profile is not None:
+            self.profile.add_command(token.value, time.perf_counter() - start)
+
+    def read_arguments(self, signature, args=None):
+        """ Read the arguments described by a compiled signature. Arguments
+            of a missing optional group are not returned, so handlers give
+            them default values.
+        """
+        if args is None:
+            args = []
+        for i, arg in enumerate(signature):
+            if type(arg) is tuple:
+                if self.parser.read("COMMA", mandatory=False) is None:
+                    break
+                self.read_arguments(arg, args)
+            else:
+                if i > 0:
+                    self.parser.read("COMMA")
+                args.append(self.parser.read(arg))
 
-        self.write_statement('$ %s+=%s' % (var.escaped, val.escaped)) 
+        return args
 
-    def cmd_autoclick(self):
-        # NUM
-        autoclick = self.parser.read("NUM").value
+    @command('add', 'VARNUM|VARSTR,NUMBER|STRING')
+    def cmd_add(self, var, val):
+        self.check_assignment(var, val)
+        self.write_statement('$ %s+=%s' % (var.escaped, val.escaped))
 
-    def cmd_bg(self):
-        bg = self.parser.read(["STR", "COLOR", "VARSTR", "STRALIAS"])
-        comma = self.parser.read("COMMA", mandatory=False)
-        if comma is not None:
-            effect = self.parser.read(["NUM", "VARNUM", "NUMALIAS"])
+    @command('autoclick', 'NUM')
+    def cmd_autoclick(self, autoclick):
+        pass
 
+    @command('bg', 'STR|COLOR|VARSTR|STRALIAS[,NUMBER]')
+    def cmd_bg(self, bg, effect=None):
         self.write_statement('$ renpy.scene()')
-        self.write_statement('$ show_image(ns_state, %s, "bg")' % bg.escaped)
+        self.write_statement('$ show_image(ns_state, %s, "bg")' % self.image(bg))
+        self.write_effect(effect)
 
+    @command('br', '')
     def cmd_br(self):
         self.write_statement('"{fast}{nw}"')
 
-    def cmd_btn(self):
-        # NUM,NUM,NUM,NUM,NUM,NUM,NUM
-        self.parser.read("NUM")
-        self.parser.read("COMMA")
-        self.parser.read("NUM")
-        self.parser.read("COMMA")
-        self.parser.read("NUM")
-        self.parser.read("COMMA")
-        self.parser.read("NUM")
-        self.parser.read("COMMA")
-        self.parser.read("NUM")
-        self.parser.read("COMMA")
-        self.parser.read("NUM")
-        self.parser.read("COMMA")
-        self.parser.read("NUM")
-
-    def cmd_btndef(self):
-        filename = self.parser.read(['STR', 'VARSTR', 'STRALIAS', 'IDENTIFIER'])
-
-    def cmd_btnwait(self):
-        var = self.parser.read("VARNUM")
-        val = Token('NUM', 0, 0)
-        self.write_statement('$ %s=%s' % (var.escaped, val.escaped)) 
+    @command('btn', 'NUM,NUM,NUM,NUM,NUM,NUM,NUM')
+    def cmd_btn(self, *args):
+        pass
 
-    def cmd_caption(self):
-        caption = self.parser.read(['STR', 'STRALIAS', 'VARSTR'])
+    @command('btndef', 'STRING|IDENTIFIER')
+    def cmd_btndef(self, filename):
+        pass
 
-    def cmd_cl(self):
-        # IDENTIFIER,NUM
-        pos = self.parser.read("IDENTIFIER").value
-        self.parser.read("COMMA")
-        effect = self.parser.read(["NUM", "VARNUM", "NUMALIAS"])
+    @command('btnwait', 'VARNUM')
+    def cmd_btnwait(self, var):
+        val = Token('NUM', 0, 0)
+        self.write_statement('$ %s=%s' % (var.escaped, val.escaped))
 
+    @command('caption', 'STRING')
+    def cmd_caption(self, caption):
+        pass
+
+    @command('cl', 'IDENTIFIER,NUMBER')
+    def cmd_cl(self, pos, effect):
+        pos = pos.value
         if pos == 'a':
             self.write_statement('$ renpy.hide("r")')
             self.write_statement('$ renpy.hide("c")')
             self.write_statement('$ renpy.hide("l")')
         else:
             self.write_statement('$ renpy.hide("%s")' % pos)
+        self.write_effect(effect)
 
+    @command('click', '')
     def cmd_click(self):
         self.write_statement('$ renpy.pause()')
 
+    @command('clickstr')
     def cmd_clickstr(self):
         self.parser.read(['STR', 'STRALIAS', 'VARSTR', 'TEXT'])
         while (self.parser.read('COMMA', mandatory=False) is not None):
@@ -453,89 +656,82 @@ class Translator(object):
                 break
         self.parser.read(["NUM", "VARNUM", "NUMALIAS"])
 
-
-    def cmd_cmp(self):
-        # VARNUM, STR, STR
-        var = self.parser.read('VARNUM')
-        self.parser.read('COMMA')
-        str1 = self.parser.read(['STR', 'STRALIAS', 'VARSTR'])
-        self.parser.read('COMMA')
-        str2 = self.parser.read(['STR', 'STRALIAS', 'VARSTR'])
-
+    @command('cmp', 'VARNUM,STRING,STRING')
+    def cmd_cmp(self, var, str1, str2):
         self.write_statement('$ %s=cmp(%s, %s)' % (var.escaped, str1.escaped, str2.escaped))
 
-    def cmd_csp(self):
-        # NUM
-        id = self.parser.read("NUM").value
-        if id == '-1':
-            self.write_statement('$ for img in ns_state.sprites: renpy.hide(img)')
-        else:
-            self.write_statement('hide s%s' % id)
+    @command('csp', 'NUM')
+    def cmd_csp(self, id):
+        if id.value != '-1':
+            self.parser.use_index('sprites', id.value)
+        self.write_statement('$ clear_sprite(ns_state, %s)' % id.value)
 
-    def cmd_d(self):
-        # NUM
-        wait = self.parser.read(["NUM", "NUMALIAS"])
+    @command('!d', 'NUM|NUMALIAS')
+    def cmd_d(self, wait):
         self.write_statement('$ renpy.pause(%s/1000.0)' % wait.value)
 
-    def cmd_date(self):
-        year = self.parser.read("VARNUM")
-        self.parser.read('COMMA')
-        month = self.parser.read("VARNUM")
-        self.parser.read('COMMA')
-        day = self.parser.read("VARNUM")
+    @command('date', 'VARNUM,VARNUM,VARNUM')
+    def cmd_date(self, year, month, day):
+        pass
 
-    def cmd_dec(self):
-        # VARNUM
-        var = self.parser.read("VARNUM")
+    @command('dec', 'VARNUM')
+    def cmd_dec(self, var):
         self.write_statement('$ %s-=1' % var.escaped)
 
-    def cmd_delay(self):
-        # NUM
-        wait = self.parser.read(["NUM", "VARNUM", "NUMALIAS"])
+    @command('delay', 'NUMBER')
+    def cmd_delay(self, wait):
         self.write_statement('$ renpy.pause(%s/1000.0)' % wait.value)
 
-    def cmd_effect(self):
-        # NUM,NUM[,NUM[,STR]]
-        effect_id = self.parser.read(["NUM", "VARNUM", "NUMALIAS"])
-        self.parser.read("COMMA")
-        effect_type = self.parser.read(["NUM", "VARNUM", "NUMALIAS"])
-        comma = self.parser.read("COMMA", mandatory=False)
-        if comma is not None:
-            duration = self.parser.read(["NUM", "VARNUM", "NUMALIAS"])
-            comma = self.parser.read("COMMA", mandatory=False)
-            if comma is not None:
-                filename = self.parser.read(['STR', 'STRALIAS', 'VARSTR'])
-            else:
-                filename = None
-        else:
-            duration = 0
-            filename = None
+    @command('effect', 'NUMBER,NUMBER[,NUMBER[,STRING]]')
+    def cmd_effect(self, effect_id, effect_type, duration=None, filename=None):
+        constant = True
+        try:
+            number = int(effect_id.escaped)
+            definition = (int(effect_type.escaped), int(duration.escaped) if duration is not None else 0)
+        except ValueError:
+            constant = False
+        mask = 'None'
+        if constant and filename is not None:
+            mask = filename.escaped
+            literal = self.parser.pool.literal(mask) if self.parser.pool is not None else mask
+            constant = literal.startswith('"')
+        if not constant:
+            # transitions are built at init time, before variables are set
+            sys.stderr.write('Effect not constant at %d\n' % effect_id.line)
+            return
+        self.effects[number] = definition + (mask,)
 
-    def cmd_effectblank(self):
-        self.parser.read(["NUM", "VARNUM", "NUMALIAS"])
+    @command('effectblank', 'NUMBER')
+    def cmd_effectblank(self, duration):
+        pass
 
+    @command('end', '')
     def cmd_end(self):
         self.write_statement('$ renpy.full_restart()')
 
+    @command('filelog', '')
     def cmd_filelog(self):
         pass
 
+    @command('game', '')
     def cmd_game(self):
         pass
 
+    @command('globalon', '')
     def cmd_globalon(self):
         pass
 
-    def cmd_gosub(self):
-        # LABEL
-        label = self.parser.read("LABEL").value
-        self.write_statement('call %s' % label.replace('*', ''))
+    @command('gosub', 'LABEL')
+    def cmd_gosub(self, label):
+        self.use_label(label.value.replace('*', ''))
+        self.write_statement('call %s' % label.value.replace('*', ''))
 
-    def cmd_goto(self):
-        # LABEL
-        label = self.parser.read("LABEL").value
-        self.write_statement('jump %s' % label.replace('*', ''))
+    @command('goto', 'LABEL')
+    def cmd_goto(self, label):
+        self.use_label(label.value.replace('*', ''))
+        self.write_statement('jump %s' % label.value.replace('*', ''))
 
+    @command('if')
     def cmd_if(self, notif=False):
         stmt = 'if'
         while True:
@@ -544,7 +740,7 @@ class Translator(object):
                 filename = self.parser.read(['STR', 'VARSTR', 'STRALIAS', 'IDENTIFIER'])
                 stmt += ' 0 ==1'
             else:
-                op = self.parser.read(["NUM", "VARNUM", "NUMALIAS", "LT", "LE", "GT", "GE", "EQ", "NEQ", "AND", "OR"], mandatory=False)
+                op = self.parser.read(CONDITION, mandatory=False)
 
                 if op is None:
                     break
@@ -565,56 +761,38 @@ class Translator(object):
                 break
         self.indent -= 1
 
-    def cmd_inc(self):
-        # VARNUM
-        var = self.parser.read("VARNUM")
+    @command('inc', 'VARNUM')
+    def cmd_inc(self, var):
         self.write_statement('$ %s+=1' % var.escaped)
 
-    def cmd_ld(self):
-        # IDENTIFIER,STR,NUM
-        pos = self.parser.read("IDENTIFIER")
-        self.parser.read("COMMA")
-        sprite = self.parser.read(["STR", "VARSTR", "STRALIAS"])
-        self.parser.read("COMMA")
-        effect = self.parser.read(["NUM", "VARNUM", "NUMALIAS"])
-
-        self.write_statement('$ show_standing(ns_state, %s, "%s")' % (sprite.escaped, pos.escaped))
-
-    def cmd_lookbackbutton(self):
-        self.parser.read(["STR", "VARSTR", "STRALIAS"])
-        self.parser.read("COMMA")
-        self.parser.read(["STR", "VARSTR", "STRALIAS"])
-        self.parser.read("COMMA")
-        self.parser.read(["STR", "VARSTR", "STRALIAS"])
-        self.parser.read("COMMA")
-        self.parser.read(["STR", "VARSTR", "STRALIAS"])
-
-    def cmd_lookbackcolor(self):
-        col = self.parser.read('COLOR')
-
-    def cmd_lsp(self):
-        # NUM,STR,NUM,NUM,NUM
-        id = self.parser.read(["NUM", "VARNUM", "NUMALIAS"])
-        self.parser.read("COMMA")
-        sprite = self.parser.read(["STR", "VARSTR", "STRALIAS"])
-        self.parser.read("COMMA")
-        xpos = self.parser.read(["NUM", "VARNUM", "NUMALIAS"])
-        self.parser.read("COMMA")
-        ypos = self.parser.read(["NUM", "VARNUM", "NUMALIAS"])
-        if self.parser.read("COMMA", mandatory=False) is not None:
-            alpha = self.parser.read(["NUM"]).value
+    @command('ld', 'IDENTIFIER,STRING,NUMBER')
+    def cmd_ld(self, pos, sprite, effect):
+        self.write_statement('$ show_standing(ns_state, %s, "%s")' % (self.image(sprite), pos.escaped))
+        self.write_effect(effect)
+
+    @command('lookbackbutton', 'STRING,STRING,STRING,STRING')
+    def cmd_lookbackbutton(self, *args):
+        pass
+
+    @command('lookbackcolor', 'COLOR')
+    def cmd_lookbackcolor(self, col):
+        pass
+
+    @command('lsp', 'NUMBER,STRING,NUMBER,NUMBER[,NUM]')
+    def cmd_lsp(self, id, sprite, xpos, ypos, alpha=None):
+        if alpha is not None:
+            alpha = alpha.value
         else:
             alpha = '0'
 
-        self.write_statement('$ store_show_sprite(ns_state, %s, %s, %s, %s, %s)' % (sprite.escaped, id.escaped, xpos.escaped, ypos.escaped, alpha))
+        self.parser.use_index('sprites', id.escaped)
+        self.write_statement('$ store_show_sprite(ns_state, %s, %s, %s, %s, %s)' % (self.image(sprite), id.escaped, xpos.escaped, ypos.escaped, alpha))
 
-    def cmd_menuselectcolor(self):
-        self.parser.read("COLOR")
-        self.parser.read("COMMA")
-        self.parser.read("COLOR")
-        self.parser.read("COMMA")
-        self.parser.read("COLOR")
+    @command('menuselectcolor', 'COLOR,COLOR,COLOR')
+    def cmd_menuselectcolor(self, *args):
+        pass
 
+    @command('menusetwindow')
     def cmd_menusetwindow(self):
         # NUM,NUM,NUM,NUM,NUM,NUM,COLOR
         for i in range(6):
@@ -623,94 +801,84 @@ class Translator(object):
 
         bg = self.parser.read(["STR", "COLOR"])
 
-    def cmd_monocro(self):
-        col = self.parser.read(['COLOR', 'IDENTIFIER'])
+    @command('monocro', 'COLOR|IDENTIFIER')
+    def cmd_monocro(self, col):
+        pass
 
-    def cmd_mov(self):
-        var = self.parser.read(["VARNUM", "VARSTR"])
-        self.parser.read("COMMA")
+    @command('mov', 'VARNUM|VARSTR,NUMBER|STRING')
+    def cmd_mov(self, var, val):
+        self.check_assignment(var, val)
+        self.write_statement('$ %s=%s' % (var.escaped, val.escaped))
 
-        if var.type == "VARNUM":
-            val = self.parser.read(["NUM", "VARNUM", "NUMALIAS"])
-        else:
-            val = self.parser.read(["STR", "VARSTR", "STRALIAS"])
-
-        self.write_statement('$ %s=%s' % (var.escaped, val.escaped)) 
-
-    def cmd_msp(self):
-        # NUM,NUM,NUM,NUM
-        id = self.parser.read("NUM")
-        self.parser.read("COMMA")
-        xpos = self.parser.read(["NUM"])
-        self.parser.read("COMMA")
-        ypos = self.parser.read(["NUM"])
-        if self.parser.read("COMMA", mandatory=False) is not None:
-            alpha = self.parser.read(["NUM"]).value
+    @command('msp', 'NUM,NUM,NUM[,NUM]')
+    def cmd_msp(self, id, xpos, ypos, alpha=None):
+        if alpha is not None:
+            alpha = alpha.value
         else:
             alpha = '0'
 
+        self.parser.use_index('sprites', id.escaped)
         self.write_statement('$ move_sprite(ns_state, %s, %s, %s, %s)' % (id.escaped, xpos.escaped, ypos.escaped, alpha))
 
+    @command('notif')
     def cmd_notif(self):
         return self.cmd_if(notif=True)
 
+    @command('nsa', '')
     def cmd_nsa(self):
         pass
 
-    def cmd_nsadir(self):
-        # STR
-        dir = self.parser.read("STR").value
+    @command('nsadir', 'STR')
+    def cmd_nsadir(self, dir):
+        pass
+
+    @command('numalias', 'IDENTIFIER,NUM')
+    def cmd_numalias(self, alias, val):
+        alias = alias.value
+        val = val.value
 
-    def cmd_numalias(self):
-        # IDENTIFIER,NUM
-        alias = self.parser.read("IDENTIFIER").value
-        self.parser.read("COMMA")
-        val = self.parser.read("NUM").value
-        
         self.parser.numaliases[alias] = val
         self.write_statement('# %s = %s' % (alias, val))
-        
-    def cmd_play(self):
-        # STR
-        track = self.parser.read("STR").value.replace('*', '').replace('"', '')
+
+    @command('play', 'STR')
+    def cmd_play(self, track):
+        track = track.value.replace('*', '').replace('"', '')
 
         if len(track) == 1:
             track = '0' + track
 
+        self.use_asset(1, '"CD/track%s.ogg"' % track)
         self.write_statement('play music "CD/track%s.ogg"' % track)
 
+    @command('playstop', '')
     def cmd_playstop(self):
         self.write_statement('stop music')
 
-    def cmd_print(self):
-        # NUM
-        effect = self.parser.read(["NUM", "VARNUM", "NUMALIAS"])
-
-    def cmd_quakex(self):
-        # NUM, NUM
-        amp = self.parser.read("NUM")
-        self.parser.read("COMMA")
-        dur = self.parser.read("NUM")
+    @command('print', 'NUMBER')
+    def cmd_print(self, effect):
+        self.write_effect(effect)
 
+    @command('quakex', 'NUM,NUM')
+    def cmd_quakex(self, amp, dur):
         self.write_statement('with hpunch')
 
-    def cmd_quakey(self):
-        # NUM, NUM
-        amp = self.parser.read("NUM")
-        self.parser.read("COMMA")
-        dur = self.parser.read("NUM")
-
+    @command('quakey', 'NUM,NUM')
+    def cmd_quakey(self, amp, dur):
         self.write_statement('with vpunch')
 
+    @command('repaint', '')
     def cmd_repaint(self):
         pass
 
+    @command('resettimer', '')
     def cmd_resettimer(self):
         pass
 
+    @command('return', '')
     def cmd_return(self):
         self.write_statement('return')
 
+    @command('rmenu')
     def cmd_rmenu(self):
         while True:
             text = self.parser.read("TEXT")
@@ -720,67 +888,63 @@ class Translator(object):
             if self.parser.read("COMMA", mandatory=False) is None:
                 break
 
-    def cmd_s(self):
-        speed = self.parser.read(["NUM", "NUMALIAS"])
+    @command('!s', 'NUM|NUMALIAS')
+    def cmd_s(self, speed):
+        pass
 
-    def cmd_savename(self):
-        self.parser.read(["STR", "STRALIAS", "VARSTR", "TEXT"])
-        self.parser.read("COMMA")
-        self.parser.read(["STR", "STRALIAS", "VARSTR", "TEXT"])
-        self.parser.read("COMMA")
-        self.parser.read(["STR", "STRALIAS", "VARSTR", "TEXT"])
+    @command('savename', 'STRING|TEXT,STRING|TEXT,STRING|TEXT')
+    def cmd_savename(self, *args):
+        pass
 
-    def cmd_savenumber(self):
-        self.parser.read(["NUM", "VARNUM", "NUMALIAS"])
+    @command('savenumber', 'NUMBER')
+    def cmd_savenumber(self, number):
+        pass
 
+    @command('!sd', '')
     def cmd_sd(self):
         pass
 
+    @command('select')
     def cmd_select(self):
-        self.write_statement('menu:')
+        self.write_menu('jump')
+
+    def write_menu(self, statement):
+        """ Write the menu of a select or selgosub, whose choices `statement`
+            (jump or call) their label. When predicting, the assets of the
+            labels are predicted while the player chooses.
+        """
+        choices = []
         while True:
             text = self.parser.read("TEXT")
             self.parser.read("COMMA")
             label = self.parser.read("LABEL")
-
-            text = text.value.replace('`', '')
-            text = self.escape_text(text)
-            self.write_statement('  "%s":' % text)
-            self.write_statement('    jump %s' % label.value.replace('*', ''))
+            choices.append((text, label.value.replace('*', '')))
 
             if self.parser.read("COMMA", mandatory=False) is None:
                 break
 
-    def cmd_selectcolor(self):
-        self.parser.read("COLOR")
-        self.parser.read("COMMA")
-        self.parser.read("COLOR")
-
-    def cmd_selgosub(self):
+        if self.predictions is not None:
+            labels = unique([label for text, label in choices])
+            self.write_statement('$ predict_labels(ns_state, (%s))' % ''.join("'%s', " % label for label in labels))
         self.write_statement('menu:')
-        while True:
-            text = self.parser.read("TEXT")
-            self.parser.read("COMMA")
-            label = self.parser.read("LABEL")
+        for text, label in choices:
+            self.use_label(label)
+            self.write_statement('  "%s":' % escape_choice(text.value))
+            self.write_statement('    %s %s' % (statement, label))
 
-            text = text.value.replace('`', '')
-            text = self.escape_text(text)
-            self.write_statement('  "%s":' % text)
-            self.write_statement('    call %s' % label.value.replace('*', ''))
+    @command('selectcolor', 'COLOR,COLOR')
+    def cmd_selectcolor(self, *args):
+        pass
 
-            if self.parser.read("COMMA", mandatory=False) is None:
-                break
+    @command('selgosub')
+    def cmd_selgosub(self):
+        self.write_menu('call')
 
-    def cmd_setcursor(self):
-        # NUM,STR,NUM,NUM
-        self.parser.read("NUM")
-        self.parser.read("COMMA")
-        self.parser.read("STR")
-        self.parser.read("COMMA")
-        self.parser.read("NUM")
-        self.parser.read("COMMA")
-        self.parser.read("NUM")
+    @command('setcursor', 'NUM,STR,NUM,NUM')
+    def cmd_setcursor(self, *args):
+        pass
 
+    @command('setwindow')
     def cmd_setwindow(self):
         # NUM,NUM,NUM,NUM,NUM,NUM,NUM,NUM,NUM,NUM,NUM,COLOR,NUM,NUM,NUM,NUM
         # NUM,NUM,NUM,NUM,NUM,NUM,NUM,NUM,NUM,NUM,NUM,STR,NUM,NUM
@@ -791,7 +955,7 @@ class Translator(object):
         bg = self.parser.read(["STR", "COLOR"])
 
         self.write_statement('$ renpy.scene()')
-        self.write_statement('$ show_image(ns_state, %s, "bg")' % bg.escaped)
+        self.write_statement('$ show_image(ns_state, %s, "bg")' % self.image(bg))
 
         if bg.type == "STR":
             r = 2
@@ -802,94 +966,91 @@ class Translator(object):
             self.parser.read("COMMA")
             self.parser.read("NUM")
 
+    @command('stop', '')
     def cmd_stop(self):
         self.write_statement('stop music')
         self.write_statement('stop sound')
 
-    def cmd_stralias(self):
-        # IDENTIFIER,STR
-        alias = self.parser.read("IDENTIFIER").value
-        self.parser.read("COMMA")
-        val = self.parser.read("STR").escaped
+    @command('stralias', 'IDENTIFIER,STR')
+    def cmd_stralias(self, alias, val):
+        alias = alias.value
+        val = val.escaped
 
         self.parser.straliases[alias] = val
         self.write_statement('# %s = %s' % (alias, val))
 
-    def cmd_sub(self):
-        # VARNUM, NUM
-        # VARSTR, STR
-        var = self.parser.read("VARNUM")
-        self.parser.read("COMMA")
-        val = self.parser.read(["NUM", "VARNUM", "NUMALIAS"])
+    @command('sub', 'VARNUM,NUMBER')
+    def cmd_sub(self, var, val):
+        self.write_statement('$ %s-=%s' % (var.escaped, val.escaped))
 
-        self.write_statement('$ %s-=%s' % (var.escaped, val.escaped)) 
-
-    def cmd_systemcall(self):
-        command = self.parser.read("IDENTIFIER").value
+    @command('systemcall', 'IDENTIFIER')
+    def cmd_systemcall(self, command):
+        pass
 
+    @command('textclear', '')
     def cmd_textclear(self):
         self.write_statement('nvl clear')
 
+    @command('textoff', '')
     def cmd_textoff(self):
         self.write_statement('window hide')
 
+    @command('texton', '')
     def cmd_texton(self):
         self.write_statement('window show')
 
-    def cmd_trap(self):
-        alias = self.parser.read(["IDENTIFIER", "LABEL"])
-
-    def cmd_versionstr(self):
-        # STR, STR
-        v1 = self.parser.read("STR")
-        self.parser.read("COMMA")
-        self.parser.read("STR")
+    @command('trap', 'IDENTIFIER|LABEL')
+    def cmd_trap(self, alias):
+        pass
 
-    def cmd_vsp(self):
-        # NUM,NUM
-        id = self.parser.read(["NUM", "VARNUM", "NUMALIAS"])
-        self.parser.read("COMMA")
-        visibility = self.parser.read(["NUM", "VARNUM", "NUMALIAS"])
+    @command('versionstr', 'STR,STR')
+    def cmd_versionstr(self, v1, v2):
+        pass
 
+    @command('vsp', 'NUMBER,NUMBER')
+    def cmd_vsp(self, id, visibility):
+        self.parser.use_index('sprites', id.escaped)
         self.write_statement('$ toggle_sprite(ns_state, %s, %s)' % (id.escaped, visibility.escaped))
 
-    def cmd_w(self):
-        # NUM
-        wait = self.parser.read(["NUM", "NUMALIAS"])
+    @command('!w', 'NUM|NUMALIAS')
+    def cmd_w(self, wait):
         self.write_statement('$ renpy.pause(%s/1000.0)' % wait.value)
 
-    def cmd_wait(self):
-        # NUM
-        wait = self.parser.read(["NUM", "VARNUM", "NUMALIAS"])
+    @command('wait', 'NUMBER')
+    def cmd_wait(self, wait):
         self.write_statement('$ renpy.pause(%s/1000.0)' % wait.value)
 
-    def cmd_waittimer(self):
-        # NUM
-        timer = self.parser.read(["NUM", "VARNUM", "NUMALIAS"])
+    @command('waittimer', 'NUMBER')
+    def cmd_waittimer(self, timer):
         self.write_statement('$ renpy.pause(%s/1000.0)' % timer.escaped)
 
-    def cmd_wave(self):
-        # STR
-        track = self.parser.read(["STR", "STRALIAS", "VARSTR"])
-        self.write_statement('play sound %s' % track.escaped.lower())
+    @command('wave', 'STRING')
+    def cmd_wave(self, track):
+        track = track.escaped
+        if self.parser.pool is not None:
+            # the literal is lowered, not the name referencing it
+            track = self.parser.pool.reference(self.parser.pool.literal(track).lower())
+        else:
+            track = track.lower()
+        self.use_asset(1, track)
+        self.write_statement('play sound %s' % track)
 
-    def cmd_waveloop(self):
-        # STR
-        track = self.parser.read(["STR", "STRALIAS", "VARSTR"])
+    @command('waveloop', 'STRING')
+    def cmd_waveloop(self, track):
+        self.use_asset(1, track.escaped)
         self.write_statement('play sound %s loop' % track.escaped)
 
+    @command('wavestop', '')
     def cmd_wavestop(self):
         self.write_statement('stop sound')
 
-    def cmd_windoweffect(self):
-        # NUM[,NUM[,STR]]
-        self.parser.read("NUM")
-        comma = self.parser.read("COMMA", mandatory=False)
-        if comma is not None:
-            self.parser.read("NUM")
-            comma = self.parser.read("COMMA", mandatory=False)
-            if comma is not None:
-                self.parser.read("STR")
+    @command('windoweffect', 'NUM[,NUM[,STR]]')
+    def cmd_windoweffect(self, *args):
+        pass
+
+    def check_assignment(self, var, val):
+        if (var.type == "VARNUM") != (val.type in ARGUMENTS['NUMBER']):
+            raise SyntaxError("Cannot assign %s to %s on %i" % (val.type, var.type, val.line))
 
 if __name__ == '__main__':
     parser = Parser()
@@ -0,0 +1,95 @@
+import json, time, tracemalloc
+from contextlib import contextmanager
+
+# line numbers kept as samples of each unknown command or invalid token
+SAMPLE_LINES = 10
+
+class Profile(object):
+    """ Collects the time and memory of each phase of a conversion, the
+        calls of each command and the unknown commands and invalid tokens
+        of the script, grouped so that they are reported once each.
+        With `memory`, allocations are traced with tracemalloc while the
+        profile is started, which makes the conversion several times slower.
+    """
+
+    def __init__(self, script=None, memory=True):
+        self.script = script
+        self.memory = memory
+        self.phases = []
+        self.tokens = None
+        self.commands = {}
+        self.unknown_commands = {}
+        self.invalid_tokens = {}
+
+    def start(self):
+        if self.memory:
+            tracemalloc.start()
+
+    def stop(self):
+        if self.memory:
+            tracemalloc.stop()
+
+    @contextmanager
+    def phase(self, name):
+        """ Measure the time and memory of the enclosed code: the time in
+            seconds, the peak memory and the memory still allocated at the
+            end in bytes, relative to the beginning of the phase.
+        """
+        if self.memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats = {'time': time.perf_counter() - start}
+            if self.memory:
+                current, peak = tracemalloc.get_traced_memory()
+                stats['peak'] = peak - base
+                stats['allocated'] = current - base
+            self.phases.append((name, stats))
+
+    def add_command(self, name, elapsed):
+        stats = self.commands.get(name)
+        if stats is None:
+            self.commands[name] = stats = [0, 0.0]
+        stats[0] += 1
+        stats[1] += elapsed
+
+    def add_unknown_command(self, token):
+        self._add_sample(self.unknown_commands, token.value, token.line)
+
+    def add_invalid_token(self, token):
+        self._add_sample(self.invalid_tokens, (token.type, token.value), token.line)
+
+    def _add_sample(self, table, key, line):
+        sample = table.get(key)
+        if sample is None:
+            table[key] = sample = [0, []]
+        sample[0] += 1
+        if len(sample[1]) < SAMPLE_LINES:
+            sample[1].append(line)
+
+    def report(self):
+        """ Return the profile as a dictionary. Commands are sorted by
+            decreasing time, unknown commands and invalid tokens by
+            decreasing count.
+        """
+        commands = sorted(self.commands.items(), key=lambda item: -item[1][1])
+        unknown = sorted(self.unknown_commands.items(), key=lambda item: -item[1][0])
+        invalid = sorted(self.invalid_tokens.items(), key=lambda item: -item[1][0])
+        return {
+            'script': self.script,
+            'tokens': self.tokens,
+            'memory': self.memory,
+            'phases': dict(self.phases),
+            'commands': dict((name, {'calls': calls, 'time': elapsed}) for name, (calls, elapsed) in commands),
+            'unknown_commands': [{'name': name, 'count': count, 'lines': lines} for name, (count, lines) in unknown],
+            'invalid_tokens': [{'type': type, 'value': value, 'count': count, 'lines': lines}
+                for (type, value), (count, lines) in invalid],
+        }
+
+    def write(self, filename):
+        with open(filename, 'w') as output:
+            json.dump(self.report(), output, indent=2)
+            output.write('\n')
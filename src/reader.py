@@ -0,0 +1,109 @@
+import codecs, mmap, os
+
+XOR_KEY = 0x84
+DECRYPT_TABLE = bytes(bytearray([c ^ XOR_KEY for c in range(256)]))
+CHUNK_SIZE = 1 << 20
+
+
+class DecodeError(Exception):
+    """ This exception is thrown when the script contains bytes that are not
+        valid in the script encoding. It holds the offset of the offending
+        bytes in the script file and the bytes themselves.
+    """
+    def __init__(self, offset, data):
+        self.offset = offset
+        self.data = data
+
+    def __str__(self):
+        return "Offset #%s, undecodable bytes: %r" % (self.offset, self.data)
+
+
+class ScriptReader(object):
+    """ Reads a (possibly encrypted) nscript.dat file. The file is memory
+        mapped and decrypted chunk by chunk so that only one chunk is held
+        in memory at a time. Iterating over the reader yields decoded text.
+    """
+
+    def __init__(self, filename, encrypted=True, encoding='cp932', errors='strict', chunk_size=CHUNK_SIZE):
+        """ `errors` is either 'strict', in which case a DecodeError is
+            raised on the first undecodable byte, or 'replace', in which case
+            the bytes are replaced with U+FFFD and their offsets are
+            recorded in `bad_offsets`.
+        """
+        self.filename = filename
+        self.encrypted = encrypted
+        self.encoding = encoding
+        self.errors = errors
+        self.chunk_size = chunk_size
+        self.bad_offsets = []
+        self._decoder = None
+
+    def __iter__(self):
+        return self.decode(self.chunks())
+
+    def decode(self, chunks):
+        """ Yield the decoded text of `chunks`, the successive decrypted
+            chunks of the file.
+        """
+        self._decoder = codecs.getincrementaldecoder(self.encoding)('strict')
+        self.bad_offsets = []
+        offset = 0
+        for data in chunks:
+            text = self._decode(data, offset, False)
+            offset += len(data)
+            if text:
+                yield text
+        text = self._decode(b'', offset, True)
+        if text:
+            yield text
+
+    def chunks(self):
+        """ Yield the decrypted content of the file in chunks of at most
+            `chunk_size` bytes.
+        """
+        input = open(self.filename, 'rb')
+        try:
+            if os.fstat(input.fileno()).st_size == 0:
+                return
+            content = mmap.mmap(input.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for start in range(0, len(content), self.chunk_size):
+                    data = content[start:start + self.chunk_size]
+                    if self.encrypted:
+                        data = data.translate(DECRYPT_TABLE)
+                    yield data
+            finally:
+                content.close()
+        finally:
+            input.close()
+
+    def read(self):
+        """ Return the whole decoded script. """
+        return ''.join(self)
+
+    def _decode(self, data, offset, final):
+        """ Decode `data`, which starts at byte `offset` of the file. Bytes
+            left over by the previous chunk are prepended first so the
+            reported offsets are always relative to the start of the file.
+        """
+        pending = self._decoder.getstate()[0]
+        if pending:
+            data = pending + data
+            offset -= len(pending)
+            self._decoder.reset()
+
+        text = []
+        position = 0
+        while True:
+            try:
+                text.append(self._decoder.decode(data[position:], final))
+                return ''.join(text)
+            except UnicodeDecodeError as e:
+                start = position + e.start
+                if self.errors == 'strict':
+                    raise DecodeError(offset + start, data[start:position + e.end])
+                self._decoder.reset()
+                text.append(data[position:start].decode(self.encoding))
+                text.append(u'\ufffd')
+                self.bad_offsets.append(offset + start)
+                position += e.end
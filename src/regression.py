@@ -0,0 +1,84 @@
+""" Regression checks of the rewrites of the generated statements.
+
+    python regression.py [--save]
+
+Each script test/NAME.txt having an expected test/NAME.rpy is converted
+with the optimizations and the string pool (-O all --pool-strings), and the
+result compared with the expected one, which --save replaces. The scripts
+are written in clear text and encrypted to a temporary nscript.dat.
+"""
+import difflib, glob, io, os, shutil, sys, tempfile
+from optparse import OptionParser
+
+import nscripter2renpy
+from reader import DECRYPT_TABLE
+from writer import Writer
+
+TESTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test')
+OPTIONS = ['-O', 'all', '--pool-strings']
+
+def convert(filename, directory):
+    """ Return the conversion of the clear text script `filename`, and the
+        messages of the conversion.
+    """
+    script = os.path.join(directory, 'nscript.dat')
+    with open(filename, 'rb') as input:
+        data = input.read()
+    with open(script, 'wb') as output:
+        output.write(data.translate(DECRYPT_TABLE))
+
+    optparser = nscripter2renpy.option_parser()
+    (options, args) = optparser.parse_args(OPTIONS + [directory])
+    nscripter2renpy.check_options(optparser, options)
+
+    result = io.StringIO()
+    output = Writer(result)
+    stderr = sys.stderr
+    sys.stderr = messages = io.StringIO()
+    try:
+        success = nscripter2renpy.convert(script, options, output)
+        output.flush()
+    finally:
+        sys.stderr = stderr
+    if not success:
+        raise Exception('cannot convert %s: %s' % (filename, messages.getvalue()))
+    return result.getvalue(), messages.getvalue()
+
+def check(filename, save=False):
+    """ Convert the script `filename` and compare it with its expected
+        conversion, or replace it with `save`. Return True if they match.
+    """
+    expected_filename = os.path.splitext(filename)[0] + '.rpy'
+    directory = tempfile.mkdtemp()
+    try:
+        result, messages = convert(filename, directory)
+    finally:
+        shutil.rmtree(directory)
+
+    if save:
+        with io.open(expected_filename, 'w', encoding='utf-8', newline='\n') as output:
+            output.write(result)
+        print('%s: saved' % os.path.basename(expected_filename))
+        return True
+
+    with io.open(expected_filename, encoding='utf-8', newline='\n') as input:
+        expected = input.read()
+    if result == expected:
+        print('%s: ok' % os.path.basename(filename))
+        return True
+    print('%s: FAILED' % os.path.basename(filename))
+    sys.stdout.writelines(difflib.unified_diff(expected.splitlines(True), result.splitlines(True),
+        expected_filename, 'converted'))
+    return False
+
+if __name__ == '__main__':
+    optparser = OptionParser(usage='usage: %prog [options] [script...]')
+    optparser.add_option('--save', dest='save', action='store_true', default=False,
+            help='store the conversions as the new expected ones')
+    (options, args) = optparser.parse_args()
+
+    scripts = args or [filename for filename in sorted(glob.glob(os.path.join(TESTS, '*.txt')))
+        if os.path.exists(os.path.splitext(filename)[0] + '.rpy')]
+    failures = [filename for filename in scripts if not check(filename, options.save)]
+    if failures:
+        sys.exit(1)
@@ -0,0 +1,116 @@
+import io, re, sys
+
+from lexer import type_code
+from parser import Parser, Translator
+
+STR = type_code("STR")
+
+# name of the n-th pooled string in the Ren'Py store
+NAME = 'ns_s%d'
+# the names of NAME in the translated script
+REFERENCE = re.compile(r'\bns_s\d+\b')
+# characters of a table entry besides the name and the literal
+ENTRY_SIZE = len('    ') + len(' = ') + len('\n')
+
+class StringPool(object):
+    """ Table of the string literals repeated in a script, which the
+        translated statements reference by name instead of copying them.
+        Literals are kept escaped, quotes included, as Parser.escape returns
+        them. Only literals whose references save more than their table
+        entry costs are pooled.
+    """
+
+    def __init__(self):
+        # literal -> name, in the order of the table
+        self.names = {}
+        self.literals = {}
+        # literal -> number of times the translated script writes it
+        self.uses = {}
+
+    def add(self, literal, uses):
+        name = NAME % len(self.names)
+        self.names[literal] = name
+        self.literals[name] = literal
+        self.uses[literal] = uses
+        return name
+
+    def reference(self, literal):
+        """ Return the name of `literal`, or `literal` if it is not pooled. """
+        return self.names.get(literal, literal)
+
+    def literal(self, reference):
+        """ Return the literal of a name returned by reference. """
+        return self.literals.get(reference, reference)
+
+    def table_size(self):
+        return sum(len(name) + len(literal) + ENTRY_SIZE for literal, name in self.names.items())
+
+    def saved(self):
+        """ Return the number of characters the pool saves, table included. """
+        saved = sum(self.uses[literal] * (len(literal) - len(name)) for literal, name in self.names.items())
+        return saved - self.table_size()
+
+class ReferenceCounter(object):
+    """ Output counting the references to pooled strings written to it. """
+
+    def __init__(self):
+        self.counts = {}
+
+    def write(self, text):
+        counts = self.counts
+        for name in REFERENCE.findall(text):
+            counts[name] = counts.get(name, 0) + 1
+
+def count_uses(parser, baked=None):
+    """ Return the number of times each string literal of the tokenized
+        script is written by the translator, with the baked images (see
+        bake.bake) replacing image paths. They are counted by translating
+        the script with all of them pooled, writing nothing; literals that
+        commands ignore are not counted.
+    """
+    candidates = StringPool()
+    for token in parser.tokens:
+        if token.code == STR:
+            literal = parser.escape(token)
+            if literal not in candidates.names:
+                candidates.add(literal, 0)
+    for path in (baked or {}).values():
+        if path not in candidates.names:
+            candidates.add(path, 0)
+
+    counting = Parser()
+    counting.use_tokens(parser.tokens)
+    counting.pool = candidates
+    counter = ReferenceCounter()
+    translator = Translator(counting, counter)
+    translator.baked = baked
+    # the messages are written by the translation of the script
+    stderr = sys.stderr
+    sys.stderr = io.StringIO()
+    try:
+        translator.translate()
+    finally:
+        sys.stderr = stderr
+        # the tokens are escaped again with the pool built
+        for token in parser.tokens:
+            token.escaped = None
+
+    # each name is written once more in the table of the pool
+    return dict((literal, counter.counts.get(name, 0) - 1) for literal, name in candidates.names.items())
+
+def build(parser, baked=None, min_uses=2):
+    """ Return the pool of the string literals of the tokenized script
+        written at least `min_uses` times (see count_uses).
+    """
+    counts = count_uses(parser, baked)
+
+    pool = StringPool()
+    # the most used literals get the shortest names; dicts keep the order
+    # literals were first found in, which sorted keeps for equal counts
+    for literal, count in sorted(counts.items(), key=lambda item: -item[1]):
+        if count < min_uses:
+            break
+        name = NAME % len(pool.names)
+        if count * (len(literal) - len(name)) > len(name) + len(literal) + ENTRY_SIZE:
+            pool.add(literal, count)
+    return pool
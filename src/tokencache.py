@@ -0,0 +1,101 @@
+""" Cache of the lexed scripts.
+
+The tokens of a script are saved in a compact binary file, by the hash of
+the script and of the lexer and parser sources, so that converting the same
+script again skips lexing. The same format passes the tokens lexed by other
+processes.
+"""
+import gc, hashlib, marshal, os, zlib
+from array import array
+
+from lexer import Token, TYPES, type_code
+import cache
+
+FORMAT = 1
+# number of lexed scripts kept by a ParseCache
+CACHE_ENTRIES = 8
+
+def dumps(tokens, level=1):
+    """ Serialize tokens in columns: type codes, lines and indices in a
+        table of the distinct values, with the names of the type codes so
+        that they can be loaded by another process. The data is compressed
+        with zlib at `level`, 0 only storing it.
+    """
+    table = {}
+    values = array('I', [table.setdefault(token.value, len(table)) for token in tokens])
+    lines = array('I', [token.line for token in tokens])
+    codes = bytes(bytearray([token.code for token in tokens]))
+    data = marshal.dumps((FORMAT, list(TYPES), codes, lines.tobytes(), values.tobytes(), list(table)))
+    return zlib.compress(data, level)
+
+def loads(data):
+    """ Return the tokens serialized by dumps. """
+    format, types, codes, lines, values, table = marshal.loads(zlib.decompress(data))
+    if format != FORMAT:
+        raise ValueError('unknown format %r' % format)
+    remap = [type_code(name) for name in types]
+    # like when lexing, the tokens cannot form reference cycles
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return list(map(Token, map(remap.__getitem__, codes), map(table.__getitem__, array('I', values)), array('I', lines)))
+    finally:
+        if enabled:
+            gc.enable()
+
+class ParseCache(object):
+    """ Tokens of the scripts lexed, saved in `directory` by the hash of the
+        script content and of the lexer and parser sources.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.signature = cache.code_signature(('lexer', 'parser'))
+        self.hits = 0
+        self.misses = 0
+
+    def filename(self, content):
+        digest = hashlib.sha1(self.signature.encode('utf8'))
+        digest.update(content.encode('utf8'))
+        return os.path.join(self.directory, digest.hexdigest() + '.tokens')
+
+    def load(self, content):
+        """ Return the tokens of `content`, or None if it is not cached. """
+        filename = self.filename(content)
+        if not os.path.exists(filename):
+            return None
+        try:
+            with open(filename, 'rb') as input:
+                return loads(input.read())
+        except (EOFError, ValueError, TypeError, zlib.error):
+            return None
+
+    def save(self, content, tokens):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        filename = self.filename(content)
+        with open(filename + '.tmp', 'wb') as output:
+            output.write(dumps(tokens))
+        os.rename(filename + '.tmp', filename)
+
+        entries = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.tokens')]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for entry in entries[CACHE_ENTRIES:]:
+            os.remove(entry)
+
+    def tokenize(self, parser, content, lex=None):
+        """ Tokenize `content` with `parser`, loading the tokens from the
+            cache if possible, or else with `lex(parser, content)` if given.
+            They are saved before translation changes the type of aliases.
+        """
+        tokens = self.load(content)
+        if tokens is not None:
+            self.hits += 1
+            parser.use_tokens(tokens)
+        else:
+            self.misses += 1
+            if lex is not None:
+                lex(parser, content)
+            else:
+                parser.tokenize(content)
+            self.save(content, parser.tokens)
@@ -0,0 +1,97 @@
+import io, os, re
+
+BUFFER_SIZE = 1 << 16
+
+# a label at the beginning of a line, where a script can be split
+LABEL = re.compile(r"^label (\w+):", re.M)
+
+class Writer(object):
+    """ Buffers the output of the translator, so that the file is written
+        in large blocks instead of once per statement.
+    """
+
+    def __init__(self, out, size=BUFFER_SIZE):
+        self.out = out
+        self.size = size
+        self.parts = []
+        self.buffered = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            self.out.write(''.join(self.parts))
+            self.parts = []
+            self.buffered = 0
+
+class ScriptWriter(Writer):
+    """ Writes the translated script to `filename`. If `shard_size` is set,
+        the script is split at labels into files of about `shard_size`
+        characters named after `filename` (script_001.rpy, script_002.rpy...),
+        each ending with a jump to the label starting the next one so that
+        they can be compiled independently. Files are written under a
+        temporary name and only replace the previous ones on close.
+    """
+
+    def __init__(self, filename, shard_size=None, size=BUFFER_SIZE):
+        Writer.__init__(self, None, size)
+        self.filename = filename
+        self.shard_size = shard_size
+        self.shards = []
+        self.written = 0
+        self.open_shard()
+
+    def shard_name(self, index):
+        if self.shard_size is None:
+            return self.filename
+        base, ext = os.path.splitext(self.filename)
+        return '%s_%03d%s' % (base, index, ext)
+
+    def open_shard(self):
+        self.shards.append(self.shard_name(len(self.shards) + 1))
+        self.out = io.open(self.shards[-1] + '.tmp', 'w', encoding='utf-8')
+        self.written = 0
+
+    def write(self, text):
+        start = 0
+        while self.shard_size is not None:
+            # the current shard is only closed once it is large enough
+            position = start + max(self.shard_size - self.written - self.buffered, 0)
+            if position >= len(text):
+                break
+            match = LABEL.search(text, position)
+            if match is None:
+                break
+            Writer.write(self, text[start:match.start()])
+            Writer.write(self, '  jump %s\n' % match.group(1))
+            self.flush()
+            self.out.close()
+            self.open_shard()
+            start = match.start()
+        Writer.write(self, text[start:])
+
+    def flush(self):
+        self.written += self.buffered
+        Writer.flush(self)
+
+    def close(self, commit=True):
+        """ Close the last file and rename the files to their final names if
+            `commit`, removing the shards left by a previous larger script.
+            Otherwise, the files are removed.
+        """
+        self.flush()
+        self.out.close()
+        for shard in self.shards:
+            if commit:
+                os.rename(shard + '.tmp', shard)
+            else:
+                os.remove(shard + '.tmp')
+        if commit and self.shard_size is not None:
+            index = len(self.shards) + 1
+            while os.path.exists(self.shard_name(index)):
+                os.remove(self.shard_name(index))
+                index += 1